@@ -0,0 +1,206 @@
+# benchmark.py
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import platform
+import argparse
+import statistics
+import subprocess
+import contextlib
+from make_big_file import SHAPES, generate_csv
+from gcsv_tuning import usable_cores
+
+try:
+    import resource  # Peak RSS on Linux/macOS
+except ImportError:
+    resource = None
+
+# Operations timed at every thread count, and baselines without GCSV (timed once, with threads=1)
+GCSV_OPS = ('compress', 'decompress', 'read_gcsv', 'to_gcsv')
+BASELINE_OPS = ('csv_read', 'csv_write', 'gzip_compress', 'gzip_decompress', 'gzip_read_csv')
+
+def run_benchmarks(csv_file, work_dir, threads=(1,), repeat=3, ops=GCSV_OPS + BASELINE_OPS):
+    """
+    Time every operation on csv_file, each run in a fresh Python process so peak memory is measured on its own.
+    Every operation runs repeat times and its median time and largest peak are kept.
+    :return: {"op@threads": {"seconds", "mb_s", "peak_mb"[, "ratio"]}}, throughput being in MB of CSV per second.
+    """
+    csv_mb = os.path.getsize(csv_file) / (1024 * 1024)
+    _prepare_inputs(csv_file, work_dir)
+    results = {}
+    for op in ops:
+        for max_threads in (threads if op in GCSV_OPS else (1,)):
+            runs = [_run_case(op, csv_file, work_dir, max_threads) for _ in range(repeat)]
+            seconds = statistics.median(run['seconds'] for run in runs)
+            result = {'seconds': round(seconds, 4), 'mb_s': round(csv_mb / seconds, 2), 'peak_mb': max(run['peak_mb'] for run in runs)}
+            if 'output_bytes' in runs[0]:
+                result['ratio'] = round(os.path.getsize(csv_file) / runs[0]['output_bytes'], 3)
+            results[f"{op}@{max_threads}"] = result
+            print(f"{op:>16} @ {max_threads:<3} {result['mb_s']:>9.2f} MB/s {result['peak_mb']:>9.1f} MB peak", file=sys.stderr)
+    return results
+
+def compare_results(results, baseline, tolerance=0.1):
+    """
+    Compare results against a stored baseline run and return a description of every regression:
+    an operation whose throughput dropped, or whose peak memory grew, by more than tolerance (i.e 0.1 = 10%).
+    Operations missing from either run are not compared.
+    """
+    regressions = []
+    for key, old in baseline.get('results', {}).items():
+        new = results.get(key)
+        if new is None:
+            continue
+        if new['mb_s'] < old['mb_s'] * (1 - tolerance):
+            regressions.append(f"{key}: throughput {old['mb_s']} -> {new['mb_s']} MB/s")
+        # Memory within 1 MB of the baseline is measurement noise, even when that is more than tolerance
+        if new['peak_mb'] > old['peak_mb'] * (1 + tolerance) and new['peak_mb'] - old['peak_mb'] > 1:
+            regressions.append(f"{key}: peak memory {old['peak_mb']} -> {new['peak_mb']} MB")
+    return regressions
+
+def _prepare_inputs(csv_file, work_dir):
+    """Write the GCSV and gzip files read by the decompression benchmarks (from the current code, every run)."""
+    from compress import gcsv_compress
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        gcsv_compress(csv_file, os.path.join(work_dir, 'bench.gcsv'))
+    _gzip_file(csv_file, os.path.join(work_dir, 'bench.csv.gz'))
+
+def _run_case(op, csv_file, work_dir, max_threads):
+    """Run one operation in a child process and return its measurements."""
+    case = {'op': op, 'csv_file': csv_file, 'work_dir': work_dir, 'max_threads': max_threads}
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-case', json.dumps(case)],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+def _reset_peak_rss():
+    """
+    Reset the peak resident memory of this process to its current size where the OS allows it (Linux),
+    so the peak measured next belongs to the next operation and not to its setup.
+    :return: The baseline to subtract from the next peak, in MB.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return _proc_status_mb('VmRSS')
+    except OSError:
+        return _peak_rss_mb()
+
+def _peak_rss_mb():
+    """Peak resident memory of this process so far, in MB (0 where the OS doesn't report it)."""
+    if os.path.exists('/proc/self/status'):
+        return _proc_status_mb('VmHWM')
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024  # Bytes on macOS, KB elsewhere
+
+def _proc_status_mb(field):
+    """Read a memory field of /proc/self/status (reported in kB) in MB."""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+    return 0
+
+def _case(op, csv_file, work_dir, max_threads):
+    """
+    Run one operation (in the child process) and return its time, the peak memory it added over the setup,
+    and for the compressors the size of their output.
+    The DataFrame written by to_gcsv and csv_write is loaded before the clock starts and the peak is reset.
+    """
+    import pandas as pd
+    import pandas_gcsv
+    from compress import gcsv_compress
+    from decompress import gcsv_decompress
+
+    gcsv_file = os.path.join(work_dir, 'bench.gcsv')
+    gzip_file = os.path.join(work_dir, 'bench.csv.gz')
+    output_file = os.path.join(work_dir, f'bench.{op}.out')
+    df = pd.read_csv(csv_file) if op in ('to_gcsv', 'csv_write') else None
+
+    ops = {
+        'compress': lambda: gcsv_compress(csv_file, output_file, max_threads=max_threads),
+        'decompress': lambda: gcsv_decompress(gcsv_file, output_file, max_threads),
+        'read_gcsv': lambda: pandas_gcsv.read_gcsv(gcsv_file, max_threads=max_threads),
+        'to_gcsv': lambda: pandas_gcsv.to_gcsv(df, output_file, max_threads=max_threads),
+        'csv_read': lambda: pd.read_csv(csv_file),
+        'csv_write': lambda: df.to_csv(output_file, index=False),
+        'gzip_compress': lambda: _gzip_file(csv_file, output_file),
+        'gzip_decompress': lambda: _gunzip_file(gzip_file, output_file),
+        'gzip_read_csv': lambda: pd.read_csv(gzip_file),
+    }
+
+    baseline = _reset_peak_rss()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        ops[op]()
+        seconds = time.perf_counter() - start
+    result = {'seconds': seconds, 'peak_mb': round(max(_peak_rss_mb() - baseline, 0), 1)}
+    if op in ('compress', 'to_gcsv', 'gzip_compress'):
+        result['output_bytes'] = os.path.getsize(output_file)
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    return result
+
+def _gzip_file(input_file, output_file):
+    with open(input_file, 'rb') as f_in, gzip.open(output_file, 'wb', compresslevel=6) as f_out:
+        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+
+def _gunzip_file(input_file, output_file):
+    with gzip.open(input_file, 'rb') as f_in, open(output_file, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark GCSV throughput and peak memory on a generated dataset, against CSV and gzip baselines.")
+    parser.add_argument("--size", type=float, default=100, help="Size of the generated CSV file in MB (i.e 100)")
+    parser.add_argument("--shape", choices=SHAPES, default='mixed', help="Kind of rows to generate (see make_big_file.py)")
+    parser.add_argument("--columns", type=int, default=None, help="Number of columns of the words and numeric shapes")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the generated dataset")
+    parser.add_argument("--threads", type=int, nargs='+', default=None, help="Thread counts to benchmark (defaults to 1 and the usable cores)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per operation (the median time is kept)")
+    parser.add_argument("--ops", nargs='+', choices=GCSV_OPS + BASELINE_OPS, default=GCSV_OPS + BASELINE_OPS, help="Operations to benchmark")
+    parser.add_argument("--work-dir", default="bench", help="Directory for the generated dataset and the files written by the benchmarks")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file (i.e results.json)")
+    parser.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Slowdown or memory growth over the baseline reported as a regression (i.e 0.1 for 10%%)")
+    parser.add_argument("--run-case", default=None, help=argparse.SUPPRESS)  # Used by the benchmark's own child processes
+    args = parser.parse_args()
+
+    if args.run_case:
+        case = json.loads(args.run_case)
+        print(json.dumps(_case(case['op'], case['csv_file'], case['work_dir'], case['max_threads'])))
+        sys.exit(0)
+
+    # The dataset is generated once per size, shape and seed, and reused by later runs
+    os.makedirs(args.work_dir, exist_ok=True)
+    dataset = {'size_mb': args.size, 'shape': args.shape, 'columns': args.columns, 'seed': args.seed}
+    csv_file = os.path.abspath(os.path.join(args.work_dir, f"{args.shape}_{args.columns or 'default'}_{args.size:g}mb_{args.seed}.csv"))
+    if not os.path.exists(csv_file):
+        print(f"generating {csv_file}", file=sys.stderr)
+        generate_csv(csv_file, args.size, args.shape, args.columns, args.seed)
+
+    threads = args.threads or sorted({1, usable_cores()})
+    results = run_benchmarks(csv_file, os.path.abspath(args.work_dir), threads, args.repeat, args.ops)
+    report = {
+        'machine': {'host': platform.node(), 'platform': platform.platform(), 'python': platform.python_version(), 'cores': usable_cores()},
+        'dataset': dataset,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('dataset') != dataset:
+            print(f"warning: the baseline was run on another dataset ({baseline.get('dataset')})", file=sys.stderr)
+        regressions = compare_results(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        print(f"{len(regressions)} regression(s) against {args.baseline}" if regressions else f"no regressions against {args.baseline}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -1,53 +1,271 @@
 # compress.py
+import os
+import csv
+import sys
+import time
 import zlib
 import argparse
-from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from functools import partial
+from gcsv_codecs import available_codecs, get_codec, train_dictionary
+from gcsv_tuning import PROBE_SIZE, TARGETS, auto_settings
+from gcsv_metrics import Metrics, progress_bar
+from gcsv_format import (
+    FLAG_COLUMNAR, FLAG_ROW_ALIGNED, check_csv_header, count_rows, csv_chunk_stats, iter_with_last, iter_row_aligned,
+    appending, chunk_writer, dataset_files, load_for_append, map_ordered, write_file_header, write_index,
+)
 
-def compress_chunk(chunk):
-    """Compress a single chunk of data."""
-    return zlib.compress(chunk)
+def compress_chunk(chunk, codec=None):
+    """Compress a single chunk of data (with zlib at its default level unless a codec is given)."""
+    return (codec or get_codec()).compress(chunk)
 
 # We divide the file in chunks and then divide those chunks between threads to compress individually
-def gcsv_compress(input_file, output_file, chunk_size=10, max_threads=16):
+def gcsv_compress(input_file, output_file, chunk_size=10, max_threads=16, row_aligned=True, max_in_flight=None, stats=False,
+                  codec='zlib', level=None, append=False, dictionary=False, auto=None, metrics=None):
     """
-    Split the input file into 1 MB chunks, compress each chunk using multiple threads,
-    and write the compressed chunks sequentially to the output file.
+    Split the input file into chunk_size MB chunks, compress each chunk using multiple threads,
+    and write the compressed chunks sequentially to the output file, followed by the chunk index.
+    With row_aligned, the CSV header is stored as its own chunk and every chunk is cut at the last
+    row boundary (honoring quoted fields) so chunks can be parsed independently.
+    At most max_in_flight chunks (default 2 * max_threads) are held in memory at any time.
+    With stats (row-aligned only), per-chunk column min/max/null counts are recorded so readers can skip chunks.
+    Chunks are compressed with the named codec (see gcsv_codecs) at level, or at the codec's default level.
+    With dictionary, a preset dictionary trained on the first block is stored once in the file header and
+    shared by every chunk, which keeps the ratio of small chunks close to that of one big stream.
+    With append, the rows of the input file are added to an existing output file (see gcsv_append).
+    The gzip codec writes every chunk as a gzip member instead, so the output is also a valid .gz file.
+    With auto ('max_throughput' or 'max_ratio'), chunk_size, max_threads and level are replaced by settings probed
+    on the first few MB of the input on this machine, and cached per host for later runs (see gcsv_tuning).
+    Nothing is printed; pass a gcsv_metrics.Metrics as metrics to collect stage timings or report progress.
     """
+    if auto:
+        with open(input_file, 'rb') as f_in:
+            sample = f_in.read(PROBE_SIZE)
+        chunk_size, max_threads, level = auto_settings(sample, codec, auto, os.path.getsize(input_file))
+    if append and os.path.exists(output_file) and os.path.getsize(output_file) > 0:
+        return gcsv_append(input_file, output_file, chunk_size, max_threads, max_in_flight, stats, metrics)
+    chunk_codec = get_codec(codec, level)
+    if stats and codec == 'gzip':
+        raise ValueError("gzip GCSV files have no room for column statistics")
+
     # Open the input and output files in binary mode (important for linux/windows compatibility)
     with open(input_file, 'rb') as f_in, open(output_file, 'wb') as f_out:
-        # Create a thread pool where threads will pick tasks from
-        with ThreadPoolExecutor() as executor:
-            print(f"compressing with {executor._max_workers} max threads and {chunk_size} MB chunks with 4 bytes header per compressed block")
-            executor._max_workers = max_threads  # Set the maximum number of threads to use
-            futures = []  # We'll store futures (results) for each chunk compression task for post sequential writing
+        # Read the input file chunk by chunk until the end of the file
+        chunks = iter(lambda: f_in.read(int(chunk_size * 1024 * 1024)), b'')
+        if dictionary:
+            # Train the preset dictionary on the first block, then put the block back in front
+            first = next(chunks, b'')
+            chunk_codec = get_codec(codec, level, train_dictionary(first))
+            chunks = chain([first], chunks)
+
+        if metrics is not None:
+            metrics.total = os.path.getsize(input_file)
+            metrics.info.update(codec=codec, level=chunk_codec.level, chunk_size_mb=chunk_size,
+                                dictionary_bytes=len(chunk_codec.zdict or b''))
+        write_file_header(f_out, chunk_codec)
+
+        if row_aligned:
+            chunks = iter_row_aligned(chunks)
+
+        items = iter_with_last(chunks)
+        if stats and row_aligned:
+            items = _with_columns(items)
 
-            # Read the input file chunk by chunk until the end of the file
-            while True:
-                chunk = f_in.read(chunk_size * 1024 * 1024)
-                if not chunk:
-                    break
+        compress = partial(compress_task, codec=chunk_codec, row_aligned=row_aligned)
+        index = compress_stream(items, f_out, max_threads, max_in_flight, compress, chunk_codec, metrics=metrics)
 
-                # Delegate chunk compression to a thread and store the future
-                futures.append(executor.submit(compress_chunk, chunk))
+        # Write the chunk index and trailer so readers can seek straight to any chunk
+        write_index(f_out, index, FLAG_ROW_ALIGNED if row_aligned else 0, codec=chunk_codec)
+
+def gcsv_append(input_file, output_file, chunk_size=10, max_threads=16, max_in_flight=None, stats=False, metrics=None):
+    """
+    Append the rows of a CSV file to an existing GCSV file without recompressing what is already there.
+    The input's header line must match the file's; only the new rows are compressed (with the file's codec)
+    into fresh row-aligned chunks, then the metadata, chunk index and trailer are rewritten after them.
+    """
+    with open(input_file, 'rb') as f_in, open(output_file, 'r+b') as f_out:
+        chunk_codec, index, flags, metadata = load_for_append(f_out)
+        if flags & FLAG_COLUMNAR:
+            raise ValueError("can't append CSV rows to a columnar GCSV file, use pandas_gcsv.to_gcsv(mode='a')")
+
+        # The header line of the input is checked against the file's and not stored again
+        chunks = iter_row_aligned(iter(lambda: f_in.read(int(chunk_size * 1024 * 1024)), b''))
+        header = next(chunks, b'')
+        check_csv_header(f_out, index, chunk_codec, header)
+        if metrics is not None:
+            metrics.total = os.path.getsize(input_file) - len(header)
+            metrics.info.update(codec=chunk_codec.name, level=chunk_codec.level, chunk_size_mb=chunk_size, appended_after_chunks=len(index))
+
+        columns = next(csv.reader([header.decode('utf-8')]), []) if stats and flags & FLAG_ROW_ALIGNED and chunk_codec.name != 'gzip' else None
+        items = ((chunk, is_last, columns) for chunk, is_last in iter_with_last(chunks))
+
+        compress = partial(compress_task, codec=chunk_codec, row_aligned=bool(flags & FLAG_ROW_ALIGNED))  # Rows are lines in byte-aligned files
+        with appending(f_out, chunk_codec, index):  # A failed append puts the file back as it was
+            index = compress_stream(items, f_out, max_threads, max_in_flight, compress, chunk_codec, index, metrics)
+            write_index(f_out, index, flags, metadata, chunk_codec)
+
+def gcsv_compress_many(inputs, output_dir, chunk_size=10, max_threads=16, row_aligned=True, max_in_flight=None, stats=False,
+                       codec='zlib', level=None, metrics=None):
+    """
+    Compress many CSV files (paths, or directories whose .csv files are all taken) into output_dir in one run.
+    Every input becomes <output_dir>/<name>.gcsv (keeping its path relative to an input directory). The chunks
+    of all the files go through one pool of max_threads threads, which reads the next files while the current
+    one is finishing, so many small files keep every core busy instead of being compressed one at a time.
+    The other arguments are those of gcsv_compress (dictionaries, appending and auto tuning are per file only).
+    :return: The paths of the written GCSV files, in input order.
+    """
+    if stats and codec == 'gzip':
+        raise ValueError("gzip GCSV files have no room for column statistics")
+    jobs = _many_jobs(inputs, output_dir)
+    chunk_codec = get_codec(codec, level)
+    write_chunk = chunk_writer(chunk_codec)
+    if metrics is not None:
+        metrics.total = sum(os.path.getsize(input_file) for input_file, _ in jobs)
+        metrics.info.update(codec=codec, level=chunk_codec.level, chunk_size_mb=chunk_size, files=len(jobs))
 
-            # Iterate over the completed futures to get compressed data
-            for future in futures:
-                compressed_chunk = future.result()  # Get the compressed chunk
+    def items():
+        # (file number, work item) for the chunks of every file in turn, each file read only once the pool reaches it
+        for number, (input_file, _) in enumerate(jobs):
+            with open(input_file, 'rb') as f_in:
+                chunks = iter(lambda: f_in.read(int(chunk_size * 1024 * 1024)), b'')
+                if row_aligned:
+                    chunks = iter_row_aligned(chunks)
+                file_items = iter_with_last(chunks)
+                if stats and row_aligned:
+                    file_items = _with_columns(file_items)
+                for item in file_items:
+                    yield number, item
 
-                print(f"compressing chunk {futures.index(future)}: {len(compressed_chunk)} bytes")
-                
-                # (chunk_header): Write the size of the compressed chunk (as 4 bytes (2^32 bits)) to the output file
-                f_out.write(len(compressed_chunk).to_bytes(4, 'big'))
+    def compress(numbered_item):
+        number, item = numbered_item
+        return number, compress_task(item, chunk_codec, row_aligned)
+
+    # Results come back in order, so the output files are written one after the other
+    flags = FLAG_ROW_ALIGNED if row_aligned else 0
+    current, f_out, index = -1, None, []
+    try:
+        for number, (compressed_chunk, raw_length, rows, *extra) in map_ordered(compress, items(), max_threads, max_in_flight, metrics):
+            start = time.perf_counter()
+            while current < number:
+                # Finish the previous file (and any empty input in between), then start the next one
+                if f_out is not None:
+                    _finish_output(f_out, index, flags, chunk_codec)
+                current += 1
+                f_out, index = _open_output(jobs[current][1], chunk_codec), []
+            write_chunk(f_out, compressed_chunk, raw_length, rows, index, *extra)
+            if metrics is not None:
+                metrics.add('write', time.perf_counter() - start)
+                metrics.chunk_done(raw_length, len(compressed_chunk))
+        if f_out is not None:
+            _finish_output(f_out, index, flags, chunk_codec)
+        for _, output_file in jobs[current + 1:]:
+            _finish_output(_open_output(output_file, chunk_codec), [], flags, chunk_codec)  # Empty inputs after the last chunk
+    finally:
+        if f_out is not None:
+            f_out.close()
+    return [output_file for _, output_file in jobs]
+
+def _many_jobs(inputs, output_dir):
+    """Expand the inputs of gcsv_compress_many into (input CSV file, output GCSV file) pairs, checking outputs are unique."""
+    jobs = []
+    for path in inputs:
+        if os.path.isdir(path):
+            names = [os.path.relpath(input_file, path) for input_file in dataset_files(path, '.csv')]
+            jobs += [(os.path.join(path, name), name) for name in names]
+        else:
+            jobs.append((path, os.path.basename(path)))
+    jobs = [(input_file, os.path.join(output_dir, os.path.splitext(name)[0] + '.gcsv')) for input_file, name in jobs]
+    outputs = [output_file for _, output_file in jobs]
+    duplicates = sorted({output_file for output_file in outputs if outputs.count(output_file) > 1})
+    if duplicates:
+        raise ValueError(f"several inputs would be written to {', '.join(duplicates)}")
+    return jobs
+
+def _open_output(output_file, codec):
+    """Create an output file of gcsv_compress_many (and its directory) and write its header."""
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    f_out = open(output_file, 'wb')
+    write_file_header(f_out, codec)
+    return f_out
+
+def _finish_output(f_out, index, flags, codec):
+    """Write the chunk index and trailer of an output file of gcsv_compress_many and close it."""
+    write_index(f_out, index, flags, codec=codec)
+    f_out.close()
+
+def compress_stream(items, f_out, max_threads=16, max_in_flight=None, compress=None, codec=None, index=None, metrics=None):
+    """
+    Compress an iterable of work items on a pool of max_threads threads and write the chunks to f_out in order.
+    Items are pulled from the iterable only while fewer than max_in_flight (default 2 * max_threads)
+    are waiting to be compressed or written, so a slow writer holds back the reader and memory stays
+    bounded by the window size instead of the input size.
+    :param items: (chunk, is_last[, columns]) tuples, or any item the compress function accepts.
+    :param compress: Function turning an item into (compressed_chunk, raw_length, rows[, stats[, crc]]) (defaults to compress_task).
+    :param codec: Codec used by the default compress function, and to pick how chunks are written (see chunk_writer).
+    :param index: Index entries of the chunks already in f_out, when appending to a file.
+    :param metrics: gcsv_metrics.Metrics recording the read, queue wait, compress and write times and the bytes in and out.
+    :return: The chunk index entries of the written chunks.
+    """
+    index = [] if index is None else index  # Chunk index entries, written after the last chunk by the caller
+    compress = compress or partial(compress_task, codec=codec)
+    write_chunk = chunk_writer(codec)
+
+    for compressed_chunk, raw_length, rows, *extra in map_ordered(compress, items, max_threads, max_in_flight, metrics):
+        # Write the chunk header and data to the output file and record the chunk in the index
+        start = time.perf_counter()
+        write_chunk(f_out, compressed_chunk, raw_length, rows, index, *extra)
+        if metrics is not None:
+            metrics.add('write', time.perf_counter() - start)
+            metrics.chunk_done(raw_length, len(compressed_chunk))
+
+    return index
+
+def compress_task(item, codec=None, row_aligned=True):
+    """
+    Compress a (chunk, is_last[, columns]) item into (compressed_chunk, raw_length, rows, stats, crc),
+    crc being the CRC32 of the uncompressed chunk. Rows are counted as lines for byte-aligned chunks (see count_rows).
+    When the CSV column names are given, the chunk's column statistics are computed as well (stats is None otherwise).
+    """
+    chunk, is_last, *columns = item
+    chunk_stats = csv_chunk_stats(columns[0], chunk) if columns and columns[0] is not None else None
+    return compress_chunk(chunk, codec), len(chunk), count_rows(chunk, is_last, row_aligned), chunk_stats, zlib.crc32(chunk)
 
-                # (chunk_data): Write the compressed chunk data to the output file
-                f_out.write(compressed_chunk)
+def _with_columns(items):
+    """Attach the CSV column names (parsed from the header chunk) to every (chunk, is_last) item after the header."""
+    columns = None
+    for chunk, is_last in items:
+        yield chunk, is_last, columns
+        if columns is None:
+            columns = next(csv.reader([chunk.decode('utf-8')]), [])
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Compress a CSV file into a compressed GCSV file.")
-    parser.add_argument("input_file", help="Path to the input CSV file. (i.e bitcoin.csv)")
-    parser.add_argument("output_file", help="Path to the output compressed GCSV file. (i.e bitcoin.gcsv)")
-    parser.add_argument("--chunk-size", type=int, default=10, help="Size of the chunks in megabytes (Mbs) to read from the input file (i.e 10)")
+    parser = argparse.ArgumentParser(description="Compress a CSV file (or many, or a directory of them) into compressed GCSV files.")
+    parser.add_argument("input_file", nargs='+', help="Path to the input CSV file(s) or directories of CSV files. (i.e bitcoin.csv, or exports/)")
+    parser.add_argument("output_file", help="Path to the output compressed GCSV file, or output directory for several inputs. (i.e bitcoin.gcsv)")
+    parser.add_argument("--chunk-size", type=float, default=10, help="Size of the chunks in megabytes (Mbs) to read from the input file (i.e 10, or 0.25 with --dictionary)")
     parser.add_argument("--max-threads", type=int, default=16, help="Maximum number of threads to use for compression (i.e 16)")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="Maximum number of chunks held in memory at once (defaults to 2 x max threads)")
+    parser.add_argument("--byte-aligned", action="store_true", help="Cut chunks at exact byte boundaries instead of row boundaries")
+    parser.add_argument("--stats", action="store_true", help="Record per-chunk column min/max/null counts so readers can skip chunks with filters")
+    parser.add_argument("--codec", default="zlib", choices=available_codecs(), help="Compression codec (i.e zlib for speed, lzma for ratio)")
+    parser.add_argument("--level", type=int, default=None, help="Compression level of the codec (i.e 1 for zlib fast writes, 9 for lzma archives)")
+    parser.add_argument("--dictionary", action="store_true", help="Share a preset dictionary trained on the start of the input between all chunks (zlib only)")
+    parser.add_argument("--auto", choices=TARGETS, default=None, help="Pick chunk size, threads and level by probing the input on this machine (cached per host)")
+    parser.add_argument("--progress", action="store_true", help="Draw a progress bar on stderr")
+    parser.add_argument("--metrics", default=None, help="Write a JSON summary of stage timings, bytes and worker utilization to this file ('-' for stderr)")
+    parser.add_argument("--append", action="store_true", help="Append the input rows to an existing output file (same CSV header, the file's codec is kept)")
     args = parser.parse_args()
 
-    gcsv_compress(args.input_file, args.output_file, args.chunk_size, args.max_threads)
\ No newline at end of file
+    metrics = Metrics('compress', progress_bar() if args.progress else None) if args.progress or args.metrics else None
+    if len(args.input_file) > 1 or os.path.isdir(args.input_file[0]):
+        if args.append or args.dictionary or args.auto:
+            parser.error("--append, --dictionary and --auto take a single input file")
+        gcsv_compress_many(args.input_file, args.output_file, args.chunk_size, args.max_threads, not args.byte_aligned, args.max_in_flight,
+                           args.stats, args.codec, args.level, metrics)
+    else:
+        gcsv_compress(args.input_file[0], args.output_file, args.chunk_size, args.max_threads, not args.byte_aligned, args.max_in_flight, args.stats,
+                      args.codec, args.level, args.append, args.dictionary, args.auto, metrics)
+    if args.progress:
+        print(file=sys.stderr)
+    if args.metrics:
+        metrics.write_summary(args.metrics)
\ No newline at end of file
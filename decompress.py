@@ -1,85 +1,217 @@
 # decompress.py
-import zlib
+import os
+import sys
+import time
 import argparse
-import threading
-from queue import Queue
-
-CHUNK_SIZE_BYTES = 4  # (chunk_header as defined in compress.py) 4 bytes to store the effective size of each compressed chunk
-
-def decompress_chunk(chunk_data, chunk_index, output_queue):
-    """
-    Decompress a chunk of data and store the result in the queue.
-    The queue ensures the chunks are written in the correct order.
-    """
-    decompressed_data = zlib.decompress(chunk_data)  # Decompress the chunk
-    output_queue.put((chunk_index, decompressed_data))  # Store in the queue with its index
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from gcsv_cache import file_key
+from gcsv_codecs import get_codec
+from gcsv_metrics import Metrics, progress_bar
+from gcsv_format import (
+    CHUNK_HEADER_BYTES, ROW, data_end, has_index, is_columnar, is_row_aligned, read_file_header, read_index, chunks_for_bytes, chunk_for_row,
+    map_ordered, map_file, iter_mapped_chunks, decompress_checked,
+)
+
+CHUNK_SIZE_BYTES = CHUNK_HEADER_BYTES  # (chunk_header as defined in compress.py) 4 bytes to store the effective size of each compressed chunk
+
+def decompress_chunk(chunk_data, codec=None):
+    """Decompress a single chunk of data (zlib unless a codec is given)."""
+    return (codec or get_codec()).decompress(chunk_data)
+
+def read_codec(input_file):
+    """Return the codec the chunks of a GCSV file are compressed with (from its file header)."""
+    with open(input_file, 'rb') as f_in:
+        return read_file_header(f_in)[0]
 
 def read_chunks(input_file):
     """
     Generator to read compressed chunks from the input GCSV file.
-    Each chunk is read with a 4-byte header that specifies the chunk's size.
+    Each chunk is located through its 4-byte header that specifies the chunk's size.
+    The file is memory-mapped and chunks are yielded as memoryview slices of it, so no bytes are copied
+    here and the pages are only read when a decompressor worker touches them.
     """
     with open(input_file, 'rb') as f_in:
-        chunk_index = 0  # Track the order of chunks
+        _check_row_major(f_in)
+        end = data_end(f_in)  # Chunks stop where the chunk index starts
+        start = read_file_header(f_in)[1]  # Chunks start right after the file header
+        view = map_file(f_in)
 
-        # Read the file until no more chunks are found
-        while True:
-            chunk_header = f_in.read(CHUNK_SIZE_BYTES)
-            if not chunk_header:
-                break
+    # Yield the chunk index and the chunk data to caller (don't iterate through it yet)
+    yield from enumerate(iter_mapped_chunks(view, start, end))
 
-            # Convert the header to an integer
-            chunk_size = int.from_bytes(chunk_header, 'big')
+def read_indexed_chunks(input_file):
+    """
+    Return the chunk index of the input GCSV file and a generator of its compressed chunks, in the same order.
+    Chunks are located through their index entries and yielded as memoryview slices of the memory-mapped file,
+    so they can be checked against their entry when decompressed (see decompress_checked).
+    Files without an index get None instead: their chunks are walked header by header (see read_chunks),
+    as rebuilding the index would decompress the whole file one more time.
+    """
+    with open(input_file, 'rb') as f_in:
+        _check_row_major(f_in)
+        if not has_index(f_in):
+            return None, (chunk_data for _, chunk_data in read_chunks(input_file))
+        index = read_index(f_in)
+        view = map_file(f_in)
+    return index, (view[entry.offset:entry.offset + entry.length] for entry in index)
+
+def gcsv_decompress(input_file, output_file=None, max_threads=16, max_in_flight=None, metrics=None):
+    """
+    Decompress the GCSV file using a pool of max_threads threads to speed up the process.
+    Each chunk is written to output_file (or stdout when it is None or '-') as soon as every chunk
+    before it is done, so at most max_in_flight (default 2 * max_threads) chunks are held in memory.
+    Nothing is printed; pass a gcsv_metrics.Metrics as metrics to collect stage timings or report progress.
+    """
+    to_stdout = output_file in (None, '-')
+
+    codec = read_codec(input_file)  # The codec is detected from the file header
+    index, chunks = read_indexed_chunks(input_file)
+    if metrics is not None:
+        metrics.total = sum(entry.length for entry in index) if index is not None else os.path.getsize(input_file)
+        metrics.info.update(codec=codec.name)
+    f_out = sys.stdout.buffer if to_stdout else open(output_file, 'wb')
+    try:
+        decompress_stream(chunks, f_out, max_threads, max_in_flight, codec, metrics, entries=index)
+        if to_stdout:
+            f_out.flush()  # Only once everything is written, a failed flush would hide the original error
+    finally:
+        if not to_stdout:
+            f_out.close()
+
+def decompress_stream(chunks, f_out, max_threads=16, max_in_flight=None, codec=None, metrics=None, entries=None):
+    """
+    Decompress an iterable of compressed chunks on a pool of max_threads threads and write them to f_out in order.
+    Each chunk is written as soon as every chunk before it is done.
+    With entries (the index entries of the chunks, in the same order), every chunk is checked against its entry,
+    so a corrupt chunk raises a ValueError naming it (see decompress_checked).
+    With metrics (a gcsv_metrics.Metrics), the stage timings and the bytes in and out of every chunk are recorded.
+    """
+    decompress = partial(decompress_chunk, codec=codec)
+    if entries is not None:
+        chunks = zip(chunks, entries)
+        decompress = lambda item: decompress_checked(codec, *item)
+    if metrics is None:
+        for decompressed_data in map_ordered(decompress, chunks, max_threads, max_in_flight):
+            f_out.write(decompressed_data)
+        return
 
-            # Read the compressed chunk data for chunk_size bytes
-            chunk_data = f_in.read(chunk_size)
+    # Workers also return the compressed size, the slices are gone once they are decompressed
+    def decompress_counted(item):
+        return len(item if entries is None else item[0]), decompress(item)
 
-            # Yield the chunk index and the chunk data to caller (don't iterate through it yet)
-            yield chunk_index, chunk_data
+    for compressed_length, decompressed_data in map_ordered(decompress_counted, chunks, max_threads, max_in_flight, metrics):
+        start = time.perf_counter()
+        f_out.write(decompressed_data)
+        metrics.add('write', time.perf_counter() - start)
+        metrics.chunk_done(compressed_length, len(decompressed_data))
 
-            # Increment the chunk index for the next chunk
-            chunk_index += 1
+def _check_row_major(f_in):
+    """Columnar files don't hold CSV text chunk after chunk, so only pandas_gcsv.read_gcsv can read them."""
+    if is_columnar(f_in):
+        raise ValueError("columnar GCSV files can only be read with pandas_gcsv.read_gcsv")
 
-def gcsv_decompress(input_file, output_file):
+def decompress_entries(f_in, entries, max_threads=4):
     """
-    Decompress the GCSV file using multiple threads to speed up the process.
-    Ensure the decompressed chunks are written sequentially to the output file.
+    Seek to and decompress only the given index entries, in parallel.
+    Returns the decompressed chunks in the same order as the entries (checked against their length and CRC32).
+    Chunks held by the process-wide chunk cache (see gcsv_cache) aren't decompressed again.
     """
-    output_queue = Queue()  # "Priority by index" queue to store decompressed chunks for ordered writing
-    threads = []
-
-    # Launch threads to decompress each chunk in parallel
-    for chunk_index, chunk_data in read_chunks(input_file):
-        thread = threading.Thread(
-            target=decompress_chunk,
-            args=(chunk_data, chunk_index, output_queue)  # Pass chunk data and queue
-        )
-        thread.start() 
-        threads.append(thread)  # Add the thread to list
-
-    # Thread endpoint join
-    for thread in threads:
-        thread.join()
+    codec, _ = read_file_header(f_in)
+    key = file_key(f_in)
+    view = map_file(f_in)  # Workers read their chunk straight from the mapping
+    with ThreadPoolExecutor(max_workers=max_threads) as executor:
+        futures = [
+            executor.submit(decompress_checked, codec, view[entry.offset:entry.offset + entry.length], entry, key)
+            for entry in entries
+        ]
+        return [future.result() for future in futures]
+
+def read_range(input_file, byte_start, byte_end, max_threads=4):
+    """
+    Read the uncompressed bytes [byte_start, byte_end) of a GCSV file.
+    Only the chunks overlapping the range are read and decompressed.
+    """
+    with open(input_file, 'rb') as f_in:
+        _check_row_major(f_in)
+        index = read_index(f_in)
+        if byte_end <= byte_start or not index:
+            return b''
 
-    with open(output_file, 'wb') as f_out:
-        # Create an empty list to store the decompressed chunks in proper order
-        results = [None] * len(threads)
+        entries = chunks_for_bytes(index, byte_start, byte_end)
+        if not entries:
+            return b''
+        data = b''.join(decompress_entries(f_in, entries, max_threads))
 
-        # Extract decompressed chunks from the queue and store them by index
-        while not output_queue.empty():
-            chunk_index, decompressed_data = output_queue.get()
-            results[chunk_index] = decompressed_data  # Store in the correct position
-            print(f"decompressed chunk {chunk_index}: {len(decompressed_data)} bytes")
+    # Trim the decompressed chunks down to the requested range
+    start = byte_start - entries[0].raw_offset
+    return data[max(start, 0):byte_end - entries[0].raw_offset]
 
-        # Write the decompressed chunks sequentially to the output file
-        for decompressed_data in results:
-            f_out.write(decompressed_data)
-    print("done")
+def read_rows(input_file, row_start, row_end, max_threads=4):
+    """
+    Read rows [row_start, row_end) of the uncompressed GCSV data (row 0 being the CSV header).
+    Rows of row-aligned files are CSV rows, which may hold line breaks inside quoted fields;
+    rows of byte-aligned files are lines (their chunks can start inside a quoted field).
+    Only the chunks holding those rows are read and decompressed.
+    """
+    with open(input_file, 'rb') as f_in:
+        _check_row_major(f_in)
+        row_aligned = is_row_aligned(f_in)
+        index = read_index(f_in)
+        if row_end <= row_start or not index:
+            return b''
+
+        # A line starts right after the newline of the previous one, so begin at the chunk where that line ends
+        first = chunk_for_row(index, row_start - 1) if row_start > 0 else 0
+        last = chunk_for_row(index, row_end - 1)
+        entries = index[first:last + 1]
+        data = b''.join(decompress_entries(f_in, entries, max_threads))
+
+    # Row numbers inside the decompressed data are relative to the first chunk read
+    row_offset = entries[0].row_offset
+    start = _after_nth_row(data, row_start - row_offset, row_aligned) if row_start > 0 else 0
+    end = _after_nth_row(data, row_end - row_offset, row_aligned)
+    return data[start:end]
+
+def _after_nth_row(data, n, row_aligned=False):
+    """
+    Return the position right after the n-th row in data (or len(data) if there are fewer).
+    With row_aligned, data starts on a row boundary and rows end at newlines outside quoted fields.
+    """
+    position = 0
+    quoted = row_aligned and b'"' in data
+    for _ in range(n):
+        if quoted:
+            match = ROW.match(data, position)
+            if match is None:
+                return len(data)
+            position = match.end()
+            continue
+        position = data.find(b'\n', position)
+        if position == -1:
+            return len(data)
+        position += 1
+    return position
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Decompress a GCSV file back to CSV.")
     parser.add_argument("input_file", help="Path to the input compressed GCSV file. (i.e bitcoin.gcsv)")
-    parser.add_argument("output_file", help="Path to the output CSV file. (i.e bitcoin.csv)")
+    parser.add_argument("output_file", nargs="?", default=None, help="Path to the output CSV file, stdout when omitted or '-'. (i.e bitcoin.csv)")
+    parser.add_argument("--max-threads", type=int, default=16, help="Maximum number of threads to use for decompression (i.e 16)")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="Maximum number of chunks held in memory at once (defaults to 2 x max threads)")
+    parser.add_argument("--progress", action="store_true", help="Draw a progress bar on stderr")
+    parser.add_argument("--metrics", default=None, help="Write a JSON summary of stage timings, bytes and worker utilization to this file ('-' for stderr)")
     args = parser.parse_args()
 
-    gcsv_decompress(args.input_file, args.output_file)
\ No newline at end of file
+    metrics = Metrics('decompress', progress_bar() if args.progress else None) if args.progress or args.metrics else None
+    try:
+        gcsv_decompress(args.input_file, args.output_file, args.max_threads, args.max_in_flight, metrics)
+    except BrokenPipeError:
+        # The reader of stdout went away (i.e | head): point stdout at devnull so the flush at exit
+        # doesn't fail again, and stop quietly (see the note on SIGPIPE in the Python signal docs)
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    if args.progress:
+        print(file=sys.stderr)
+    if args.metrics:
+        metrics.write_summary(args.metrics)
\ No newline at end of file
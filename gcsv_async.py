@@ -0,0 +1,250 @@
+# gcsv_async.py
+import asyncio
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from gcsv_cache import file_key
+from gcsv_codecs import get_codec
+from gcsv_format import (
+    FLAG_ROW_ALIGNED, chunk_writer, decompress_checked, first_row_end, is_columnar, is_row_aligned, last_row_end, map_file,
+    read_file_header, read_index, write_file_header, write_index,
+)
+from gcsv_tuning import usable_cores
+from compress import compress_task
+from pandas_gcsv import _SchemaCarrier, _chunk_parser, _normalize_filters, _serial_kwargs, read_gcsv
+
+# The executor shared by every async reader and writer of the process, created on first use. Its size caps how many
+# chunks are compressed, decompressed or parsed at once across all requests; max_in_flight caps each stream's share.
+_executor = None
+_max_workers = None
+
+def configure_executor(max_workers=None):
+    """
+    Size the shared executor running the codec, parsing and file work of the async API (default: the usable cores).
+    Work submitted afterwards (running streams included) goes to the new executor; the old one finishes the work
+    already queued on it and then lets its threads go.
+    """
+    global _executor, _max_workers
+    old = _executor
+    _max_workers = max_workers or usable_cores()
+    _executor = ThreadPoolExecutor(max_workers=_max_workers, thread_name_prefix='gcsv')
+    if old is not None:
+        old.shutdown(wait=False)
+
+def _get_executor():
+    """Return the shared executor, creating it on first use."""
+    if _executor is None:
+        configure_executor(_max_workers)
+    return _executor
+
+async def _run(func, *args):
+    """Run a blocking function on the shared executor."""
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), func, *args)
+
+async def _amap_ordered(func, items, max_in_flight=None):
+    """
+    Async counterpart of gcsv_format.map_ordered: run func on every item on the shared executor and yield the results
+    in input order, with at most max_in_flight (default 2 x the executor's workers) items submitted at once.
+    Items still pending when the consumer stops early (i.e a client disconnects) are cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    max_in_flight = max_in_flight or 2 * _max_workers
+    pending = deque()
+    try:
+        for item in items:
+            if len(pending) >= max_in_flight:
+                yield await pending.popleft()
+            pending.append(loop.run_in_executor(_get_executor(), func, item))  # configure_executor may have replaced it
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
+
+async def aiter_gcsv_chunks(gcsv_file: str, max_in_flight=None):
+    """
+    Yield the decompressed chunks (bytes of CSV text, the header line first for row-aligned files) of a GCSV file in
+    order, decompressing ahead on the shared executor, i.e to stream a file to a client while it is decompressed.
+    Chunks are checked against their length and CRC32, and come from the chunk cache when it is enabled.
+    """
+    def open_chunks():
+        with open(gcsv_file, 'rb') as f:
+            if is_columnar(f):
+                raise ValueError("columnar GCSV files can only be read with pandas_gcsv.read_gcsv")
+            index = read_index(f)
+            codec, _ = read_file_header(f)
+            key = file_key(f)
+            view = map_file(f)
+        return partial(_decompress_mapped, codec, view, key), index
+
+    decompress, index = await _run(open_chunks)
+    async for chunk in _amap_ordered(decompress, index, max_in_flight):
+        yield chunk
+
+def _decompress_mapped(codec, view, key, entry):
+    # Workers decompress zero-copy slices of the mapped file
+    return decompress_checked(codec, view[entry.offset:entry.offset + entry.length], entry, key)
+
+async def aiter_gcsv(gcsv_file: str, filters=None, on_bad_chunks='error', max_in_flight=None, **kwargs):
+    """
+    Yield one DataFrame per data chunk of a row-aligned GCSV file (like read_gcsv(chunksize='chunk')), decompressing
+    and parsing ahead on the shared executor. filters, on_bad_chunks and kwargs are those of read_gcsv.
+    """
+    if on_bad_chunks not in ('error', 'warn', 'skip'):
+        raise ValueError(f"on_bad_chunks must be 'error', 'warn' or 'skip', not {on_bad_chunks!r}")
+    if _serial_kwargs(kwargs):
+        raise ValueError(f"aiter_gcsv parses chunks on their own and doesn't take {sorted(_serial_kwargs(kwargs))}")
+
+    def open_frames():
+        with open(gcsv_file, 'rb') as f:
+            if is_columnar(f) or not is_row_aligned(f):
+                raise ValueError("aiter_gcsv requires a row-aligned GCSV file")
+        return _chunk_parser(gcsv_file, _normalize_filters(filters), on_bad_chunks, **kwargs)
+
+    parse, entries = await _run(open_frames)
+
+    conform = _SchemaCarrier('index_col' not in kwargs)
+    async for df in _amap_ordered(parse, entries, max_in_flight):
+        if df is not None:
+            yield conform(df)
+
+async def aread_gcsv(gcsv_file: str, rows: slice = None, filters=None, on_bad_chunks='error', max_in_flight=None, **kwargs) -> pd.DataFrame:
+    """
+    Async counterpart of pandas_gcsv.read_gcsv (same arguments, without chunksize and max_threads), which doesn't
+    block the event loop. Row-aligned files are decompressed and parsed chunk by chunk on the shared executor;
+    other reads (rows=, columnar or byte-aligned files, serial pd.read_csv arguments) run read_gcsv on it as a whole.
+    """
+    def per_chunk():
+        with open(gcsv_file, 'rb') as f:
+            return is_row_aligned(f) and not is_columnar(f)
+
+    if rows is None and not _serial_kwargs(kwargs) and await _run(per_chunk):
+        frames = [df async for df in aiter_gcsv(gcsv_file, filters, on_bad_chunks, max_in_flight, **kwargs)]
+        if frames:
+            return await _run(partial(pd.concat, frames, ignore_index='index_col' not in kwargs))
+    return await _run(partial(read_gcsv, gcsv_file, rows, filters=filters, on_bad_chunks=on_bad_chunks, **kwargs))
+
+class AsyncGcsvWriter:
+    """
+    Write a row-aligned GCSV file from batches arriving over time, i.e an upload being compressed as it arrives:
+
+        async with AsyncGcsvWriter('upload.gcsv') as writer:
+            async for block in request.content.iter_chunked(1 << 20):
+                await writer.write(block)
+
+    Batches are either bytes of CSV text (cut at row boundaries into chunks of about chunk_size MB, the first line
+    being the CSV header) or DataFrames with the same columns (one chunk each, rendered with DataFrame.to_csv and
+    csv_kwargs), not a mix of both. Chunks are compressed on the shared executor; write() only waits once
+    max_in_flight chunks (default 2 x the executor's workers) are pending, which holds back a fast producer.
+    """
+    def __init__(self, gcsv_file: str, chunk_size=10, codec='zlib', level=None, max_in_flight=None, **csv_kwargs):
+        self.gcsv_file = gcsv_file
+        self.codec = get_codec(codec, level)
+        self.csv_kwargs = csv_kwargs
+        self._chunk_bytes = int(chunk_size * 1024 * 1024)
+        self._max_in_flight = max_in_flight
+        self._write_chunk = chunk_writer(self.codec)
+        self._f = None
+        self._index = []
+        self._pending = deque()  # Futures of the chunks being compressed, in file order
+        self._parts, self._buffered = [], 0  # Bytes received since the last chunk
+        self._header_done = False
+        self._columns = None  # Columns of the DataFrame batches
+        self._kind = None  # bytes or pd.DataFrame, whichever came first
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            await self.close()
+        else:
+            await self.abort()
+
+    async def open(self):
+        """Create the file and write its header."""
+        def create():
+            f = open(self.gcsv_file, 'wb')
+            write_file_header(f, self.codec)
+            return f
+        self._f = await _run(create)
+
+    async def write(self, batch):
+        """Add a batch of bytes of CSV text or a DataFrame to the file."""
+        kind = pd.DataFrame if isinstance(batch, pd.DataFrame) else bytes
+        if self._kind is not None and kind is not self._kind:
+            raise ValueError("can't mix bytes and DataFrame batches in one GCSV file")
+        self._kind = kind
+
+        if kind is pd.DataFrame:
+            if self._columns is None:
+                self._columns = list(batch.columns)
+                await self._submit(batch.iloc[:0].to_csv(index=False, **self.csv_kwargs).encode('utf-8'))  # Header chunk
+            elif list(batch.columns) != self._columns:
+                raise ValueError(f"DataFrame batch columns {list(batch.columns)} don't match the file's {self._columns}")
+            if len(batch):
+                await self._submit(batch)
+            return
+
+        self._parts.append(bytes(batch))
+        self._buffered += len(batch)
+        if not self._header_done:
+            # The CSV header line goes in its own chunk, as with compress.py
+            buffer = b''.join(self._parts)
+            end = first_row_end(buffer)
+            self._parts, self._buffered = [buffer], len(buffer)
+            if end == -1:
+                return
+            self._header_done = True
+            await self._submit(buffer[:end])
+            self._parts, self._buffered = [buffer[end:]], len(buffer) - end
+
+        # Cut every full chunk_size window at its last row boundary (a row longer than the window is kept whole)
+        while self._buffered >= self._chunk_bytes:
+            buffer = b''.join(self._parts) if len(self._parts) > 1 else self._parts[0]
+            end = last_row_end(buffer[:self._chunk_bytes])
+            if end == -1:
+                end = last_row_end(buffer)
+            self._parts, self._buffered = [buffer], len(buffer)
+            if end == -1:
+                return
+            await self._submit(buffer[:end])
+            self._parts, self._buffered = [buffer[end:]], len(buffer) - end
+
+    async def close(self):
+        """Compress the remaining rows, write the chunk index and trailer and close the file."""
+        if self._buffered:
+            await self._submit(b''.join(self._parts), is_last=True)
+            self._parts, self._buffered = [], 0
+        while self._pending:
+            await self._write_oldest()
+        await _run(partial(write_index, self._f, self._index, FLAG_ROW_ALIGNED, codec=self.codec))
+        await _run(self._f.close)
+
+    async def abort(self):
+        """Stop writing without finishing the file (it is left without a chunk index, which verify.py reports)."""
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        if self._f is not None:
+            await _run(self._f.close)
+
+    async def _submit(self, data, is_last=False):
+        """Queue a chunk (bytes, or a DataFrame rendered by the worker) for compression, waiting while the window is full."""
+        executor = _get_executor()
+        while len(self._pending) >= (self._max_in_flight or 2 * _max_workers):
+            await self._write_oldest()
+        self._pending.append(asyncio.get_running_loop().run_in_executor(executor, self._compress, data, is_last))
+
+    def _compress(self, data, is_last):
+        """Worker task: render a DataFrame batch to CSV if needed, then compress it (see compress.compress_task)."""
+        if isinstance(data, pd.DataFrame):
+            data = data.to_csv(index=False, header=False, **self.csv_kwargs).encode('utf-8')
+        return compress_task((data, is_last), self.codec)
+
+    async def _write_oldest(self):
+        """Wait for the oldest pending chunk and write it to the file."""
+        compressed_chunk, raw_length, rows, stats, crc = await self._pending.popleft()
+        await _run(partial(self._write_chunk, self._f, compressed_chunk, raw_length, rows, self._index, stats, crc))
@@ -0,0 +1,192 @@
+# gcsv_cache.py
+import os
+import zlib
+import struct
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+# Counters and sizes reported by cache_info(), like functools.lru_cache's
+CacheInfo = namedtuple('CacheInfo', ['hits', 'spill_hits', 'misses', 'chunks', 'bytes', 'max_bytes', 'spill_bytes', 'max_spill_bytes'])
+
+# Spilled chunks are stored as [4-byte BE CRC32][decompressed chunk], so a damaged or half-written file is a miss
+SPILL_HEADER = struct.Struct('>I')
+
+class ChunkCache:
+    """
+    LRU cache of decompressed chunks shared by the whole process, holding at most max_bytes of chunk data in memory.
+    Entries are keyed by (file key, chunk offset), the file key being its path, mtime and size (see file_key), so a
+    rewritten or appended file never serves stale chunks. With spill_dir, chunks evicted from memory are kept on
+    local disk (up to max_spill_bytes) and read back from there instead of being decompressed again; spilled files
+    are checked against their CRC32 and can be reused by later processes. The files already in spill_dir count
+    against its budget (the oldest are dropped first), so the directory doesn't grow across runs.
+    """
+    def __init__(self, max_bytes=0, spill_dir=None, max_spill_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self._memory = OrderedDict()  # key -> chunk, least recently used first
+        self._spilled = OrderedDict()  # spill file name -> its size, least recently used first
+        self._bytes = 0
+        self._spill_bytes = 0
+        self._lock = threading.Lock()  # Reader threads share the cache
+        self.hits = self.spill_hits = self.misses = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._scan_spill_dir()
+
+    def get(self, key, load):
+        """Return the chunk cached under key, or load() it (outside the lock, so readers decompress in parallel) and cache it."""
+        with self._lock:
+            chunk = self._memory.get(key)
+            if chunk is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return chunk
+
+        chunk = self._read_spilled(key) if self.spill_dir else None
+        with self._lock:
+            if chunk is not None:
+                self.spill_hits += 1
+            else:
+                self.misses += 1
+        if chunk is None:
+            chunk = bytes(load())
+        self._put(key, chunk)
+        return chunk
+
+    def clear(self):
+        """Drop every chunk held in memory and on disk (including the ones spilled by other processes)."""
+        with self._lock:
+            self._memory.clear()
+            self._spilled.clear()
+            self._bytes = self._spill_bytes = 0
+        if self.spill_dir:
+            for entry in os.scandir(self.spill_dir):
+                if entry.name.endswith(('.chunk', '.tmp')):
+                    _remove(entry.path)
+
+    def info(self):
+        """Return the cache's counters and sizes as a CacheInfo."""
+        with self._lock:
+            return CacheInfo(self.hits, self.spill_hits, self.misses, len(self._memory), self._bytes, self.max_bytes,
+                             self._spill_bytes, self.max_spill_bytes if self.spill_dir else 0)
+
+    def _put(self, key, chunk):
+        """Cache a chunk, evicting the least recently used ones (to disk when spilling) past the byte budget."""
+        if len(chunk) > self.max_bytes:
+            return
+        evicted = []
+        with self._lock:
+            if key not in self._memory:
+                self._memory[key] = chunk
+                self._bytes += len(chunk)
+            while self._bytes > self.max_bytes:
+                old_key, old_chunk = self._memory.popitem(last=False)
+                self._bytes -= len(old_chunk)
+                evicted.append((old_key, old_chunk))
+        if self.spill_dir:
+            for old_key, old_chunk in evicted:
+                self._spill(old_key, old_chunk)
+
+    def _spill(self, key, chunk):
+        """Write an evicted chunk to the spill directory, dropping the least recently used spilled chunks past its budget."""
+        size = SPILL_HEADER.size + len(chunk)
+        if size > self.max_spill_bytes:
+            return
+        path = self._spill_path(key)
+        if not os.path.exists(path):
+            try:
+                with open(f"{path}.{os.getpid()}.{threading.get_ident()}.tmp", 'wb') as f:
+                    f.write(SPILL_HEADER.pack(zlib.crc32(chunk)))
+                    f.write(chunk)
+                os.replace(f"{path}.{os.getpid()}.{threading.get_ident()}.tmp", path)
+            except OSError:
+                return  # A full or read-only disk just means no spilling
+        self._track_spilled(os.path.basename(path), size)
+
+    def _read_spilled(self, key):
+        """Read a spilled chunk back (None if it isn't there or fails its CRC32 check, in which case it's removed)."""
+        path = self._spill_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) < SPILL_HEADER.size or SPILL_HEADER.unpack_from(data)[0] != zlib.crc32(memoryview(data)[SPILL_HEADER.size:]):
+            with self._lock:
+                self._spill_bytes -= self._spilled.pop(os.path.basename(path), 0)
+            _remove(path)  # Or it would never be spilled again
+            return None
+        self._track_spilled(os.path.basename(path), len(data))  # Spilled by another process since the scan
+        return data[SPILL_HEADER.size:]
+
+    def _scan_spill_dir(self):
+        """Count the chunks earlier processes left in the spill directory, oldest first, and drop them past its budget."""
+        found = []
+        for entry in os.scandir(self.spill_dir):
+            if entry.name.endswith('.chunk'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # Removed by another process meanwhile
+                found.append((stat.st_mtime_ns, entry.name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._track_spilled(name, size)
+
+    def _track_spilled(self, name, size):
+        """Record a spill file (of size bytes) as the most recently used, removing the least recently used ones past the budget."""
+        dropped = []
+        with self._lock:
+            self._spill_bytes += size - self._spilled.pop(name, 0)
+            self._spilled[name] = size
+            while self._spill_bytes > self.max_spill_bytes:
+                old_name, old_size = self._spilled.popitem(last=False)
+                self._spill_bytes -= old_size
+                dropped.append(old_name)
+        for old_name in dropped:
+            _remove(os.path.join(self.spill_dir, old_name))
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.chunk')
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# The process-wide cache, disabled (0 bytes) unless configured here or through $GCSV_CACHE_MB / $GCSV_CACHE_SPILL_DIR
+_cache = ChunkCache(int(float(os.environ.get('GCSV_CACHE_MB', 0)) * 1024 * 1024), os.environ.get('GCSV_CACHE_SPILL_DIR') or None)
+
+def configure_cache(max_mb=256, spill_dir=None, max_spill_mb=1024):
+    """
+    Replace the process-wide chunk cache with one holding up to max_mb MB of decompressed chunks (0 disables it),
+    spilling evicted chunks to up to max_spill_mb MB of files in spill_dir when it is given.
+    """
+    global _cache
+    _cache = ChunkCache(int(max_mb * 1024 * 1024), spill_dir, int(max_spill_mb * 1024 * 1024))
+
+def cache_info():
+    """Return the hit/miss counters and sizes of the process-wide chunk cache."""
+    return _cache.info()
+
+def clear_cache():
+    """Drop every cached chunk (including spilled ones)."""
+    _cache.clear()
+
+def file_key(f):
+    """
+    Return the cache key of an open GCSV file: its real path, mtime and size (None while the cache is disabled,
+    which tells readers not to consult it).
+    """
+    if not _cache.max_bytes:
+        return None
+    stat = os.fstat(f.fileno())
+    return os.path.realpath(f.name), stat.st_mtime_ns, stat.st_size
+
+def cached_chunk(key, offset, load):
+    """Return the decompressed chunk at offset of the file with key from the cache, or load() it and cache it."""
+    if key is None:
+        return load()
+    return _cache.get((key, offset), load)
@@ -0,0 +1,143 @@
+# gcsv_codecs.py
+import bz2
+import lzma
+import zlib
+import struct
+from functools import partial
+from collections import Counter, namedtuple
+
+# Optional codecs, registered only when their packages are installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# A codec bound to a compression level (and an optional preset dictionary, zdict):
+# compress(data) and decompress(data) work on bytes
+Codec = namedtuple('Codec', ['id', 'name', 'level', 'compress', 'decompress', 'zdict'])
+
+# name -> (codec id stored in the file header, compress(data, level), decompress(data), default level, supports zdict)
+_REGISTRY = {}
+
+ZDICT_SIZE = 32 * 1024  # zlib only looks back 32 KB, so larger dictionaries don't help it
+
+# Codec ids of the known optional codecs, so readers can name the missing package
+_OPTIONAL = {3: ('zstd', 'zstandard'), 4: ('lz4', 'lz4')}
+
+def register_codec(name, codec_id, compress, decompress, default_level, dictionaries=False):
+    """
+    Register a codec under a name and a one-byte id (the id is what GCSV files store).
+    :param compress: compress(data, level) -> bytes.
+    :param decompress: decompress(data) -> bytes.
+    :param dictionaries: Both functions also take a zdict= preset dictionary.
+    """
+    _REGISTRY[name] = (codec_id, compress, decompress, default_level, dictionaries)
+
+def available_codecs():
+    """Return the names of the codecs usable in this environment."""
+    return list(_REGISTRY)
+
+def get_codec(name='zlib', level=None, zdict=None):
+    """
+    Return the named codec bound to level (or the codec's default level) and to the zdict preset dictionary.
+    """
+    if name not in _REGISTRY:
+        raise ValueError(f"unknown or unavailable codec {name!r} (available: {', '.join(_REGISTRY)})")
+
+    codec_id, compress, decompress, default_level, dictionaries = _REGISTRY[name]
+    if zdict and not dictionaries:
+        raise ValueError(f"the {name} codec doesn't support preset dictionaries")
+    if zdict:
+        compress, decompress = partial(compress, zdict=zdict), partial(decompress, zdict=zdict)
+    level = default_level if level is None else level
+    return Codec(codec_id, name, level, partial(compress, level=level), decompress, zdict or None)
+
+def codec_from_id(codec_id, level=None, zdict=None):
+    """
+    Return the codec stored in a file header under codec_id.
+    """
+    for name, (registered_id, *_) in _REGISTRY.items():
+        if registered_id == codec_id:
+            return get_codec(name, level, zdict)
+
+    if codec_id in _OPTIONAL:
+        name, package = _OPTIONAL[codec_id]
+        raise ValueError(f"this GCSV file is compressed with {name}, install the {package!r} package to read it")
+    raise ValueError(f"unknown codec id {codec_id} in GCSV file header")
+
+def train_dictionary(sample, size=ZDICT_SIZE):
+    """
+    Build a preset dictionary from a sample of CSV data (i.e the first block of the input).
+    It holds the header line, then complete rows of the sample, then the sample's most frequent
+    fields, most frequent last where compressors reach them with the shortest distances.
+    """
+    sample = bytes(sample)
+    header_end = sample.find(b'\n') + 1
+    header, rows = sample[:header_end], sample[header_end:sample.rfind(b'\n') + 1]
+
+    counts = Counter(field for line in rows.split(b'\n') for field in line.split(b','))
+    fields = b''
+    for field, count in counts.most_common():
+        if count < 2 or len(fields) + len(field) + 1 > size // 4:
+            break
+        fields = field + b',' + fields
+
+    rows = rows[:max(size - len(header) - len(fields), 0)]
+    return (header + rows[:rows.rfind(b'\n') + 1] + fields)[-size:]
+
+def _zlib_compress(data, level, zdict=None):
+    if zdict is None:
+        return zlib.compress(data, level)
+    compressor = zlib.compressobj(level, zdict=zdict)
+    return compressor.compress(data) + compressor.flush()
+
+def _zlib_decompress(data, zdict=None):
+    if zdict is None:
+        return zlib.decompress(data)
+    decompressor = zlib.decompressobj(zdict=zdict)
+    return decompressor.decompress(data) + decompressor.flush()
+
+def _lzma_compress(data, level):
+    return lzma.compress(data, preset=level)
+
+def _bz2_compress(data, level):
+    return bz2.compress(data, compresslevel=level)
+
+def _gzip_compress(data, level):
+    # Deflate data into the body and trailer (crc32, size) of a gzip member, gcsv_format writes its header
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress(data) + compressor.flush()
+    return body + struct.pack('<II', zlib.crc32(data), len(data) & 0xFFFFFFFF)
+
+def _gzip_decompress(data):
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    chunk = decompressor.decompress(data)
+    crc, size = struct.unpack('<II', decompressor.unused_data[:8])
+    if crc != zlib.crc32(chunk) or size != len(chunk) & 0xFFFFFFFF:
+        raise ValueError("gzip member failed its CRC check")
+    return chunk
+
+register_codec('zlib', 0, _zlib_compress, _zlib_decompress, -1, dictionaries=True)  # -1 is zlib's default level (6)
+register_codec('lzma', 1, _lzma_compress, lzma.decompress, 6)
+register_codec('bz2', 2, _bz2_compress, bz2.decompress, 9)
+register_codec('gzip', 5, _gzip_compress, _gzip_decompress, -1)  # Chunks as gzip members (see gcsv_format)
+
+if zstandard is not None:
+    def _zstd_compress(data, level):
+        return zstandard.ZstdCompressor(level=level).compress(data)
+
+    def _zstd_decompress(data):
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    register_codec('zstd', 3, _zstd_compress, _zstd_decompress, 3)
+
+if lz4 is not None:
+    def _lz4_compress(data, level):
+        return lz4.frame.compress(data, compression_level=level)
+
+    register_codec('lz4', 4, _lz4_compress, lz4.frame.decompress, 0)
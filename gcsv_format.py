@@ -0,0 +1,641 @@
+# gcsv_format.py
+import io
+import os
+import re
+import csv
+import glob
+import json
+import time
+import mmap
+import zlib
+import struct
+import bisect
+from contextlib import contextmanager
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from gcsv_cache import cached_chunk
+from gcsv_codecs import codec_from_id, get_codec
+
+CHUNK_HEADER_BYTES = 4  # (chunk_header) 4 bytes to store the effective size of each compressed chunk
+
+# A GCSV file is laid out as:
+#
+#   [file_header][dictionary][chunk_header][chunk_data] ... [chunk_header][chunk_data][metadata][index entries][trailer]
+#
+# The file header names the format version and the codec every chunk is compressed with
+# (files written before it existed start straight with the first chunk and use zlib), followed
+# by the optional preset dictionary shared by all chunks (from format version 2).
+# The index holds one entry per chunk and the fixed-size trailer at the very end of the
+# file tells readers where the index starts, so any chunk can be reached with two seeks.
+# The optional metadata block is a JSON object (i.e per-chunk column statistics).
+
+# (file_header): magic, format version, codec id, compression level
+FILE_HEADER = struct.Struct('>4sBBb')
+FILE_MAGIC = b'GCSV'
+FORMAT_VERSION = 2
+
+# (dictionary header): size of the zlib-compressed preset dictionary that follows it, 0 for none (format version 2 and up)
+DICT_HEADER = struct.Struct('>I')
+
+# (index entry): compressed offset, compressed length, uncompressed offset, row count
+INDEX_ENTRY = struct.Struct('>QIQQ')
+
+# (trailer): index offset, chunk count, total uncompressed size, flags, metadata offset, metadata length, magic
+TRAILER = struct.Struct('>QQQIQQ4s')
+TRAILER_MAGIC = b'GCSI'
+
+# With the gzip codec the file is a valid multi-member .gz file instead (zcat, pd.read_csv, Spark...):
+#
+#   [member_header][deflate data][crc32][size] ... [member_header][deflate data][crc32][size][end member]
+#
+# Like BGZF, every member header has an extra field holding the member size, so readers hop from member
+# to member without inflating anything, along with the uncompressed length and row count of the chunk.
+# There is no file header or index: the empty end member holds the flags in place of the trailer.
+
+# (gzip member_header): magic, method, gzip flags (FEXTRA), mtime, extra flags, OS, extra length,
+#                       subfield id, subfield length, member size, uncompressed length, rows, flags
+GZIP_MEMBER_HEADER = struct.Struct('<2sBBIBBH2sHIQQI')
+GZIP_MAGIC = b'\x1f\x8b'
+GZIP_SUBFIELD = b'GC'
+GZIP_END_SIZE = GZIP_MEMBER_HEADER.size + 2 + 8  # empty deflate block, crc32 and size
+
+# (trailer flags)
+FLAG_ROW_ALIGNED = 1  # chunk 0 holds only the CSV header line and every other chunk ends on a row boundary
+FLAG_COLUMNAR = 2  # chunks hold one column of one row group each (see pandas_gcsv.to_gcsv(layout='columnar'))
+
+# offset/length locate the compressed chunk data (past its header) in the .gcsv file,
+# raw_offset/raw_length locate its bytes in the uncompressed data and rows counts the
+# CSV rows that end inside the chunk (row_offset being the number of rows before it),
+# which are lines in byte-aligned files (see count_rows).
+# stats maps column names to [min, max, null count] when column statistics were recorded
+# and crc is the CRC32 of the uncompressed chunk (None for files written without checksums)
+ChunkEntry = namedtuple('ChunkEntry', ['offset', 'length', 'raw_offset', 'raw_length', 'rows', 'row_offset', 'stats', 'crc'], defaults=[None, None])
+
+# Values pd.read_csv treats as missing by default (the common ones)
+NULL_VALUES = {'', 'NA', 'N/A', 'NaN', 'nan', 'NULL', 'null', 'None', '<NA>'}
+
+# A quoted field starts with a quote opening a field (at the start of the data or right after a delimiter or line break)
+# and runs up to its closing quote, escaped quotes ("") included, or to the end of the data while it isn't closed yet.
+# A quote anywhere else (i.e the inch mark of 0,5" screen) is a literal character of an unquoted field, as for pandas.
+# ROW matches one CSV row up to its newline, ROWS as many whole rows as possible. The fields of a row are matched
+# in a lookahead and then consumed with a backreference, (?=(...))\1, which the regex engine never backtracks into
+# (an atomic group that works before Python 3.11), so the matching stays linear and in C even when a row isn't closed.
+QUOTED_FIELD = rb'(?<![^,;\t|\r\n])"[^"]*(?:""[^"]*)*(?:"|\Z)'
+_ROW = rb'(?=((?:[^"\n]+|' + QUOTED_FIELD + rb'|")*))\1\n'
+ROW = re.compile(_ROW)
+ROWS = re.compile(rb'(?:' + _ROW + rb')*')
+
+def count_rows(chunk, is_last, row_aligned=True):
+    """
+    Count the CSV rows ending inside a chunk of uncompressed data: its newlines outside quoted fields, or every
+    newline without row_aligned (a byte-aligned chunk may start inside a quoted field, so its rows are lines).
+    The last chunk also owns a final row that has no trailing newline.
+    """
+    if not row_aligned or b'"' not in chunk:
+        rows = chunk.count(b'\n')
+        end = chunk.rfind(b'\n') + 1
+    else:
+        # Whole rows follow each other from the start of the chunk, up to a row still open at its end
+        rows, end = 0, 0
+        for match in ROW.finditer(chunk):
+            if match.start() != end:
+                break
+            rows, end = rows + 1, match.end()
+    if is_last and end < len(chunk):
+        rows += 1
+    return rows
+
+def iter_with_last(iterable):
+    """Yield (item, is_last) pairs, looking one item ahead."""
+    iterator = iter(iterable)
+    item = next(iterator, None)
+    while item is not None:
+        next_item = next(iterator, None)
+        yield item, next_item is None
+        item = next_item
+
+def map_ordered(func, items, max_threads=16, max_in_flight=None, metrics=None):
+    """
+    Apply func to every item on a pool of max_threads threads and yield the results in input order.
+    The in-flight futures double as the reorder buffer: items are pulled only while fewer than
+    max_in_flight (default 2 * max_threads) are waiting, and the oldest result is yielded as soon as it completes.
+    With metrics (see gcsv_metrics), the time spent pulling items, running func and waiting on results is recorded.
+    """
+    max_in_flight = max_in_flight or 2 * max_threads
+    pending = deque()  # Futures of the items in flight, in input order
+    if metrics is not None:
+        metrics.begin(max_threads)
+        func, items = metrics.timed_worker(func), metrics.timed_items(items)
+
+    with ThreadPoolExecutor(max_workers=max_threads) as executor:
+        for item in items:
+            # Backpressure: once the window is full, hand out the oldest result before reading any further
+            if len(pending) >= max_in_flight:
+                yield _oldest_result(pending, metrics)
+            pending.append(executor.submit(func, item))
+
+        # Drain the remaining items
+        while pending:
+            yield _oldest_result(pending, metrics)
+
+def _oldest_result(pending, metrics=None):
+    """Pop the oldest future and wait for its result (timed as the queue_wait stage with metrics)."""
+    if metrics is None:
+        return pending.popleft().result()
+    start = time.perf_counter()
+    result = pending.popleft().result()
+    metrics.add('queue_wait', time.perf_counter() - start)
+    return result
+
+def first_row_end(buffer):
+    """Return the position right after the first newline outside quoted fields, or -1 if there is none."""
+    if b'"' not in buffer:
+        position = buffer.find(b'\n')
+        return position + 1 if position != -1 else -1
+    match = ROW.match(buffer)
+    return match.end() if match else -1
+
+def last_row_end(buffer):
+    """
+    Return the position right after the last newline outside quoted fields, or -1 if there is none.
+    The buffer must start on a row boundary (outside quotes).
+    """
+    if b'"' not in buffer:
+        position = buffer.rfind(b'\n')
+        return position + 1 if position != -1 else -1
+    return ROWS.match(buffer).end() or -1
+
+def iter_row_aligned(blocks):
+    """
+    Regroup an iterable of raw byte blocks into row-aligned chunks.
+    The CSV header line is yielded first on its own, then every chunk ends on a row boundary
+    (rows larger than a block are carried over until they are complete).
+    """
+    carry = b''
+    header_done = False
+
+    for block in blocks:
+        if not block:
+            continue
+        buffer = carry + block if carry else block
+
+        if not header_done:
+            end = first_row_end(buffer)
+            if end == -1:
+                carry = buffer  # The header line is still incomplete
+                continue
+            yield buffer[:end]
+            buffer = buffer[end:]
+            header_done = True
+
+        end = last_row_end(buffer)
+        if end == -1:
+            carry = buffer  # No complete row yet, keep reading
+            continue
+        yield buffer[:end]
+        carry = buffer[end:]
+
+    if carry:
+        yield carry
+
+def csv_chunk_stats(columns, chunk, sep=','):
+    """
+    Compute [min, max, null count] per column of a row-aligned CSV chunk (without its header), from its CSV text.
+    Columns whose values all parse as integers get exact integer bounds (64-bit ids don't fit a float),
+    other all-numeric columns get float bounds and the rest get string bounds (i.e dates as written).
+    The chunk is parsed with pandas' C parser when pandas is installed, and with the csv module otherwise.
+    """
+    try:
+        import pandas as pd  # Imported here, so the command line tools only load pandas to record statistics
+    except ImportError:
+        return _csv_module_stats(columns, chunk, sep)
+
+    options = dict(sep=sep, header=None, index_col=False, keep_default_na=False, na_values=sorted(NULL_VALUES), skip_blank_lines=False)
+    try:
+        df = pd.read_csv(io.BytesIO(chunk), names=range(len(columns)), **options)
+    except ValueError:  # i.e a row with more fields than the header
+        return _csv_module_stats(columns, chunk, sep)
+
+    stats = {}
+    for position, name in enumerate(columns):
+        values = df[position]
+        nulls = int(values.isna().sum())
+        present = values.dropna()
+        if present.empty:
+            stats[name] = [None, None, nulls]
+            continue
+        low, high = present.min(), present.max()
+        if values.dtype.kind == 'f' and max(-low, high) >= 2 ** 53 and (present % 1 == 0).all():
+            # Integers parsed as floats (because of missing values) lose precision past 2**53, parse their text instead
+            text = pd.read_csv(io.BytesIO(chunk), usecols=[position], dtype=str, **options)[position].dropna()
+            numbers = _parse_numbers(text.tolist())
+            low, high = min(numbers), max(numbers)
+        stats[name] = [low.item() if hasattr(low, 'item') else low, high.item() if hasattr(high, 'item') else high, nulls]
+    return stats
+
+def _csv_module_stats(columns, chunk, sep=','):
+    """csv_chunk_stats parsing the chunk with the csv module (when pandas isn't installed)."""
+    stats = {}
+    values = zip(*csv.reader(io.StringIO(chunk.decode('utf-8'), newline=''), delimiter=sep))
+    for name, column in zip(columns, values):
+        present = [value for value in column if value not in NULL_VALUES]
+        nulls = len(column) - len(present)
+        numbers = _parse_numbers(present)
+        if numbers is None:
+            stats[name] = [min(present), max(present), nulls]
+        else:
+            stats[name] = [min(numbers), max(numbers), nulls] if numbers else [None, None, nulls]
+    return stats
+
+def _parse_numbers(values):
+    """Parse CSV values as ints, or as floats when one of them isn't an integer (None when they aren't all numbers)."""
+    for number in (int, float):
+        try:
+            return [number(value) for value in values]
+        except ValueError:
+            continue
+    return None
+
+def write_file_header(f_out, codec):
+    """Write the file header recording the format version and the codec of the chunks, then the codec's preset dictionary."""
+    if codec.name == 'gzip':
+        return  # gzip members carry their own headers
+    f_out.write(FILE_HEADER.pack(FILE_MAGIC, FORMAT_VERSION, codec.id, max(min(codec.level, 127), -128)))
+    zdict = zlib.compress(codec.zdict, 9) if codec.zdict else b''
+    f_out.write(DICT_HEADER.pack(len(zdict)))
+    f_out.write(zdict)
+
+def read_file_header(f):
+    """
+    Read the file header of an open GCSV file.
+    :return: (codec, offset of the first chunk); files without a header use zlib and start at offset 0.
+             The codec is bound to the file's preset dictionary, if it has one.
+    """
+    f.seek(0)
+    header = f.read(FILE_HEADER.size)
+    if header[:2] == GZIP_MAGIC:
+        return get_codec('gzip'), 0
+    if len(header) < FILE_HEADER.size or header[:4] != FILE_MAGIC:
+        return get_codec('zlib'), 0
+
+    _, version, codec_id, level = FILE_HEADER.unpack(header)
+    if version > FORMAT_VERSION:
+        raise ValueError(f"GCSV format version {version} is newer than this reader (version {FORMAT_VERSION})")
+    if version < 2:
+        return codec_from_id(codec_id, level), FILE_HEADER.size
+
+    zdict_size, = DICT_HEADER.unpack(f.read(DICT_HEADER.size))
+    zdict = zlib.decompress(f.read(zdict_size)) if zdict_size else None
+    return codec_from_id(codec_id, level, zdict), FILE_HEADER.size + DICT_HEADER.size + zdict_size
+
+def write_chunk(f_out, compressed_chunk, raw_length, rows, index, stats=None, crc=None):
+    """Write a size-prefixed compressed chunk and record its entry (with optional column stats and CRC32) in the index list."""
+    raw_offset, row_offset = _next_offsets(index)
+
+    # (chunk_header): Write the size of the compressed chunk as 4 bytes
+    f_out.write(len(compressed_chunk).to_bytes(CHUNK_HEADER_BYTES, 'big'))
+    offset = f_out.tell()
+
+    # (chunk_data): Write the compressed chunk data
+    f_out.write(compressed_chunk)
+
+    index.append(ChunkEntry(offset, len(compressed_chunk), raw_offset, raw_length, rows, row_offset, stats, crc))
+
+def write_gzip_member(f_out, compressed_chunk, raw_length, rows, index, stats=None, crc=None, flags=0):
+    """
+    Write a chunk compressed by the gzip codec as a gzip member and record its entry in the index list.
+    The member trailer already holds the CRC32 of the chunk (checked by the codec), so crc isn't stored again.
+    """
+    if stats is not None:
+        raise ValueError("gzip GCSV files have no room for column statistics")
+    raw_offset, row_offset = _next_offsets(index)
+
+    # (member_header): The extra field follows the fixed 12-byte gzip header, the subfield its 4-byte header
+    member_size = GZIP_MEMBER_HEADER.size + len(compressed_chunk)
+    f_out.write(GZIP_MEMBER_HEADER.pack(
+        GZIP_MAGIC, 8, 4, 0, 0, 255, GZIP_MEMBER_HEADER.size - 12,
+        GZIP_SUBFIELD, GZIP_MEMBER_HEADER.size - 16, member_size, raw_length, rows, flags,
+    ))
+    offset = f_out.tell()
+
+    # (deflate data, crc32, size): Write the compressed chunk data
+    f_out.write(compressed_chunk)
+
+    index.append(ChunkEntry(offset, len(compressed_chunk), raw_offset, raw_length, rows, row_offset))
+
+def chunk_writer(codec):
+    """Return the function writing the chunks of codec (gzip members for the gzip codec, size-prefixed chunks otherwise)."""
+    if codec is not None and codec.name == 'gzip':
+        return write_gzip_member
+    return write_chunk
+
+def _next_offsets(index):
+    """Return the uncompressed offset and row offset of the chunk following the index entries."""
+    if not index:
+        return 0, 0
+    return index[-1].raw_offset + index[-1].raw_length, index[-1].row_offset + index[-1].rows
+
+def write_index(f_out, index, flags=0, metadata=None, codec=None):
+    """
+    Write the metadata block, the chunk index and the fixed-size trailer that points to them.
+    Column statistics and CRC32s recorded on the entries are stored in the metadata under 'stats' and 'crc32'.
+    Files of the gzip codec get their end member instead (they have no index or metadata).
+    """
+    if codec is not None and codec.name == 'gzip':
+        if metadata:
+            raise ValueError("gzip GCSV files have no room for metadata")
+        write_gzip_member(f_out, codec.compress(b''), 0, 0, [], flags=flags)
+        return
+
+    metadata = dict(metadata or {})
+    if any(entry.stats is not None for entry in index):
+        metadata['stats'] = [entry.stats for entry in index]
+    if any(entry.crc is not None for entry in index):
+        metadata['crc32'] = [entry.crc for entry in index]
+
+    meta_offset = f_out.tell()
+    if metadata:
+        f_out.write(json.dumps(metadata, default=str).encode('utf-8'))
+    meta_length = f_out.tell() - meta_offset
+
+    index_offset = f_out.tell()
+    for entry in index:
+        f_out.write(INDEX_ENTRY.pack(entry.offset, entry.length, entry.raw_offset, entry.rows))
+
+    total_size = index[-1].raw_offset + index[-1].raw_length if index else 0
+    f_out.write(TRAILER.pack(index_offset, len(index), total_size, flags, meta_offset, meta_length, TRAILER_MAGIC))
+
+def read_trailer(f):
+    """
+    Read the trailer of an open GCSV file.
+    :return: (index_offset, chunk_count, total_size, flags, meta_offset, meta_length),
+             or None for files written without an index.
+    """
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    if is_gzip(f):
+        return _read_gzip_end(f, file_size)
+    if file_size < TRAILER.size:
+        return None
+
+    f.seek(file_size - TRAILER.size)
+    *trailer, magic = TRAILER.unpack(f.read(TRAILER.size))
+    if magic != TRAILER_MAGIC:
+        return None
+    return tuple(trailer)
+
+def is_gzip(f):
+    """Return True if the open GCSV file was written with the gzip codec (as gzip members)."""
+    f.seek(0)
+    return f.read(2) == GZIP_MAGIC
+
+def _read_gzip_end(f, file_size):
+    """Read the flags from the end member of a gzip GCSV file, as a trailer without index or metadata."""
+    if file_size < GZIP_END_SIZE:
+        return None
+    f.seek(file_size - GZIP_END_SIZE)
+    magic, *_, subfield, _, _, _, _, flags = GZIP_MEMBER_HEADER.unpack(f.read(GZIP_MEMBER_HEADER.size))
+    if magic != GZIP_MAGIC or subfield != GZIP_SUBFIELD:
+        return None
+    return None, None, None, flags, file_size - GZIP_END_SIZE, 0
+
+def read_metadata(f):
+    """Return the metadata block of an open GCSV file as a dict (empty when there is none)."""
+    trailer = read_trailer(f)
+    if trailer is None or not trailer[5]:
+        return {}
+    f.seek(trailer[4])
+    return json.loads(f.read(trailer[5]))
+
+def has_index(f):
+    """
+    Return True if the open GCSV file stores its chunk index (gzip files rebuild it from their member headers).
+    read_index has to decompress the whole file to rebuild the index of the other files.
+    """
+    return is_gzip(f) or read_trailer(f) is not None
+
+def is_row_aligned(f):
+    """Return True if the open GCSV file was written with row-aligned chunks."""
+    trailer = read_trailer(f)
+    return trailer is not None and bool(trailer[3] & FLAG_ROW_ALIGNED)
+
+def is_columnar(f):
+    """Return True if the open GCSV file was written with the columnar layout."""
+    trailer = read_trailer(f)
+    return trailer is not None and bool(trailer[3] & FLAG_COLUMNAR)
+
+def data_end(f):
+    """Return the offset where chunk data stops (the start of the metadata and index, or EOF for files without one)."""
+    trailer = read_trailer(f)
+    if trailer is not None:
+        return trailer[4]
+    return f.seek(0, os.SEEK_END)
+
+def map_file(f):
+    """
+    Memory-map an open GCSV file read-only and return a memoryview of the whole file.
+    Slicing the view doesn't copy, so chunks are read from the page cache by whichever worker decompresses them.
+    The mapping outlives f and is released once the view and every slice of it are gone.
+    """
+    if os.fstat(f.fileno()).st_size == 0:
+        return memoryview(b'')  # Empty files can't be mapped
+    return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+def iter_mapped_chunks(view, start, end):
+    """Walk the chunk headers of view[start:end], yielding a zero-copy slice of each compressed chunk."""
+    position = start
+    while position < end:
+        if view[position:position + 2] == GZIP_MAGIC:
+            # (member_header): gzip members record their own size
+            member_size, _, _ = _gzip_member_fields(view[position:position + GZIP_MEMBER_HEADER.size], position)
+            yield view[position + GZIP_MEMBER_HEADER.size:position + member_size]
+            position += member_size
+            continue
+
+        chunk_size = int.from_bytes(view[position:position + CHUNK_HEADER_BYTES], 'big')
+        position += CHUNK_HEADER_BYTES
+        yield view[position:position + chunk_size]
+        position += chunk_size
+
+def read_index(f):
+    """
+    Load the chunk index of an open GCSV file as a list of ChunkEntry.
+    Files written without an index are scanned (and decompressed) once to rebuild it.
+    """
+    if is_gzip(f):
+        return _scan_gzip_index(f)
+    trailer = read_trailer(f)
+    if trailer is None:
+        return _scan_index(f)
+
+    index_offset, chunk_count, total_size = trailer[:3]
+    metadata = read_metadata(f)
+    stats = metadata.get('stats') or [None] * chunk_count
+    crcs = metadata.get('crc32') or [None] * chunk_count
+    f.seek(index_offset)
+    raw_index = f.read(chunk_count * INDEX_ENTRY.size)
+
+    entries = list(INDEX_ENTRY.iter_unpack(raw_index))
+    raw_ends = [entry[2] for entry in entries[1:]] + [total_size]  # each chunk ends where the next one starts
+
+    index = []
+    row_offset = 0
+    for (offset, length, raw_offset, rows), raw_end, chunk_stats, crc in zip(entries, raw_ends, stats, crcs):
+        index.append(ChunkEntry(offset, length, raw_offset, raw_end - raw_offset, rows, row_offset, chunk_stats, crc))
+        row_offset += rows
+    return index
+
+def _scan_index(f):
+    """Rebuild the chunk index by walking every chunk header from the start of the file."""
+    index = []
+    end = f.seek(0, os.SEEK_END)
+    codec, start = read_file_header(f)
+    f.seek(start)
+    raw_offset, row_offset = 0, 0
+
+    while f.tell() < end:
+        chunk_size = int.from_bytes(f.read(CHUNK_HEADER_BYTES), 'big')
+        offset = f.tell()
+        chunk = codec.decompress(f.read(chunk_size))
+        rows = count_rows(chunk, f.tell() >= end, row_aligned=False)  # Files without an index predate row alignment
+
+        index.append(ChunkEntry(offset, chunk_size, raw_offset, len(chunk), rows, row_offset))
+        raw_offset += len(chunk)
+        row_offset += rows
+    return index
+
+def _scan_gzip_index(f):
+    """Rebuild the chunk index of a gzip GCSV file by hopping from member header to member header."""
+    index = []
+    end = data_end(f)
+    position = 0
+
+    while position < end:
+        f.seek(position)
+        member_size, raw_length, rows = _gzip_member_fields(f.read(GZIP_MEMBER_HEADER.size), position)
+        raw_offset, row_offset = _next_offsets(index)
+        index.append(ChunkEntry(position + GZIP_MEMBER_HEADER.size, member_size - GZIP_MEMBER_HEADER.size, raw_offset, raw_length, rows, row_offset))
+        position += member_size
+    return index
+
+def _gzip_member_fields(header, position):
+    """Return (member size, uncompressed length, rows) from a gzip member header written by write_gzip_member."""
+    if len(header) == GZIP_MEMBER_HEADER.size:
+        magic, *_, subfield, _, member_size, raw_length, rows, _ = GZIP_MEMBER_HEADER.unpack(header)
+        if magic == GZIP_MAGIC and subfield == GZIP_SUBFIELD:
+            return member_size, raw_length, rows
+    raise ValueError(f"gzip member at offset {position} wasn't written by GCSV (no chunk sizes in its header)")
+
+def read_csv_header(f, index, codec):
+    """Return the CSV header line of an open GCSV file, decompressing only the chunks it spans."""
+    data = b''
+    for entry in index:
+        f.seek(entry.offset)
+        data += codec.decompress(f.read(entry.length))
+        end = first_row_end(data)
+        if end != -1:
+            return data[:end]
+    return data
+
+def check_csv_header(f, index, codec, header):
+    """Raise a ValueError unless the CSV header line of an open GCSV file matches header (line endings aside)."""
+    existing = read_csv_header(f, index, codec)
+    if existing.rstrip(b'\r\n') != header.rstrip(b'\r\n'):
+        raise ValueError(f"CSV header {header.rstrip()!r} doesn't match the GCSV file's header {existing.rstrip()!r}")
+
+def load_for_append(f):
+    """
+    Load what appending to an open GCSV file needs, without modifying it.
+    :return: (codec, index, flags, metadata), the per-chunk statistics and CRC32s staying on the index entries.
+    """
+    trailer = read_trailer(f)
+    flags = trailer[3] if trailer is not None else 0
+    metadata = read_metadata(f)
+    metadata.pop('stats', None)  # write_index rebuilds them from the index entries
+    metadata.pop('crc32', None)
+    index = read_index(f)
+    codec, _ = read_file_header(f)
+    return codec, index, flags, metadata
+
+def truncate_for_append(f, codec, index):
+    """
+    Cut the metadata, index and trailer off an open ('r+b') GCSV file so new chunks can be written
+    after the last one (write_index then rewrites them for the whole file).
+    A last chunk without a final newline gets a chunk holding just the newline (and no rows of its own) after it,
+    so appended rows start on a new line. The file is never cut below the end of a chunk, as readers may
+    have it mapped (map_file) and touching a mapped page past the end of the file kills them with SIGBUS.
+    """
+    f.seek(data_end(f))
+    f.truncate()
+
+    if index:
+        last = index[-1]
+        f.seek(last.offset)
+        chunk = codec.decompress(f.read(last.length))
+        if chunk and not chunk.endswith(b'\n'):
+            f.seek(0, os.SEEK_END)
+            chunk_writer(codec)(f, codec.compress(b'\n'), 1, 0, index, None, zlib.crc32(b'\n'))
+    f.seek(0, os.SEEK_END)
+
+@contextmanager
+def appending(f, codec, index):
+    """
+    Cut an open ('r+b') GCSV file for appending (see truncate_for_append) for the duration of the block, which writes
+    the new chunks and the index. If the block raises, the bytes that were cut off (the metadata, the index and the
+    trailer) are written back over whatever it wrote, so a failed append leaves the file as it was.
+    """
+    start = data_end(f)
+    f.seek(start)
+    tail = f.read()
+    try:
+        truncate_for_append(f, codec, index)
+        yield
+    except BaseException:
+        f.seek(start)
+        f.write(tail)
+        f.truncate()
+        f.flush()
+        raise
+
+def decompress_checked(codec, compressed_chunk, entry, key=None):
+    """
+    Decompress a chunk and check it against its index entry: its uncompressed length and, when recorded, its CRC32.
+    Any failure (codec errors on corrupt data included) is raised as a ValueError naming the chunk.
+    With the file's key (gcsv_cache.file_key), the chunk comes from the process-wide chunk cache when it is there,
+    and is added to it otherwise.
+    """
+    if key is not None:
+        return cached_chunk(key, entry.offset, lambda: decompress_checked(codec, compressed_chunk, entry))
+    try:
+        chunk = codec.decompress(compressed_chunk)
+    except Exception as e:  # Every codec has its own error type
+        raise ValueError(f"chunk at offset {entry.offset} can't be decompressed ({e})") from e
+
+    if len(chunk) != entry.raw_length:
+        raise ValueError(f"chunk at offset {entry.offset} holds {len(chunk)} bytes instead of {entry.raw_length}")
+    if entry.crc is not None and zlib.crc32(chunk) != entry.crc:
+        raise ValueError(f"chunk at offset {entry.offset} fails its CRC32 check")
+    return chunk
+
+def dataset_files(glob_or_dir, suffix='.gcsv'):
+    """
+    Return the files of a multi-file dataset in a deterministic (sorted) order: every file ending in suffix
+    under a directory (recursively, i.e partitions written by to_gcsv(partition_by=...)), or the files matching a glob.
+    """
+    if os.path.isdir(glob_or_dir):
+        paths = [os.path.join(root, name) for root, _, names in os.walk(glob_or_dir) for name in names if name.endswith(suffix)]
+    else:
+        paths = [path for path in glob.glob(glob_or_dir, recursive=True) if os.path.isfile(path)]
+    return sorted(paths)
+
+def chunks_for_bytes(index, byte_start, byte_end):
+    """Return the index slice of chunks overlapping the uncompressed byte range [byte_start, byte_end)."""
+    ends = [entry.raw_offset + entry.raw_length for entry in index]
+    first = bisect.bisect_right(ends, byte_start)
+    last = bisect.bisect_left(ends, byte_end)
+    return index[first:last + 1]
+
+def chunk_for_row(index, row):
+    """Return the position in the index of the chunk where the given line ends."""
+    ends = [entry.row_offset + entry.rows for entry in index]
+    return min(bisect.bisect_right(ends, row), len(index) - 1)
@@ -0,0 +1,131 @@
+# gcsv_metrics.py
+import sys
+import json
+import time
+import threading
+
+# Stages timed by Metrics. The main thread reads items, waits for the oldest worker result (queue_wait) and writes
+# it out, while the workers compress or decompress. A main thread mostly waiting on workers means the job is
+# CPU-bound (more threads or a faster level help), one mostly reading and writing means it is I/O-bound.
+STAGES = ('read', 'queue_wait', 'work', 'write')
+
+class Metrics:
+    """
+    Per-stage timings and byte counts of a compression or decompression job, filled in by compress_stream
+    and decompress_stream (and map_ordered) when passed as metrics=. Nothing is timed when no Metrics is given.
+    :param work: Name of the worker stage in the summary ('compress' or 'decompress').
+    :param callback: Called with the Metrics after every chunk is written (i.e progress_bar()).
+    """
+    def __init__(self, work='compress', callback=None):
+        self.work = work
+        self.callback = callback
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.chunks = 0
+        self.threads = 1
+        self.total = None  # Expected bytes_in of the whole job, when known (for progress)
+        self.info = {}  # Settings of the job (codec, level, chunk size...) reported in the summary
+        self.started = None
+        self.finished = None
+        # Workers add their timings concurrently, and so do the jobs sharing a Metrics (i.e partitions written at once)
+        self._lock = threading.Lock()
+
+    def begin(self, threads):
+        """Start the clock (on the first call only, so appends and multi-part jobs add up)."""
+        with self._lock:
+            self.threads = max(self.threads, threads)
+            if self.started is None:
+                self.started = time.perf_counter()
+
+    def add(self, stage, seconds):
+        """Add seconds spent by the main thread in a stage."""
+        with self._lock:
+            self.seconds[stage] += seconds
+
+    def chunk_done(self, bytes_in, bytes_out):
+        """Count a written chunk and report progress."""
+        with self._lock:
+            self.chunks += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.finished = time.perf_counter()
+            if self.callback is not None:
+                self.callback(self)  # One progress update at a time
+
+    def timed_items(self, items):
+        """Yield the items of an iterable, timing how long producing each one takes as the read stage."""
+        items = iter(items)
+        while True:
+            start = time.perf_counter()
+            item = next(items, _DONE)
+            self.add('read', time.perf_counter() - start)
+            if item is _DONE:
+                return
+            yield item
+
+    def timed_worker(self, func):
+        """
+        Wrap a worker function so its CPU time is added to the work stage (the time a worker spends waiting
+        for a core or the GIL isn't work, which keeps utilization meaningful with more threads than cores).
+        """
+        def timed(item):
+            start = time.thread_time()
+            try:
+                return func(item)
+            finally:
+                elapsed = time.thread_time() - start
+                with self._lock:
+                    self.seconds['work'] += elapsed
+        return timed
+
+    def summary(self):
+        """
+        Return the job's totals as a JSON-ready dict: wall time, seconds per stage, bytes in and out, ratio,
+        throughput (MB of uncompressed data per second), worker utilization (share of the pool's time spent
+        working) and whether the main thread was mostly waiting on the workers ('cpu') or on reads and writes ('io').
+        """
+        wall = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        raw, packed = (self.bytes_in, self.bytes_out) if self.work == 'compress' else (self.bytes_out, self.bytes_in)
+        stages = {(self.work if stage == 'work' else stage): round(seconds, 4) for stage, seconds in self.seconds.items()}
+        return {
+            **self.info,
+            'chunks': self.chunks,
+            'threads': self.threads,
+            'wall_seconds': round(wall, 4),
+            'stage_seconds': stages,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': round(raw / packed, 3) if packed else None,
+            'mb_s': round(raw / (1024 * 1024) / wall, 2) if wall > 0 else None,
+            'worker_utilization': round(self.seconds['work'] / (wall * self.threads), 3) if wall > 0 else None,
+            'bound': 'cpu' if self.seconds['queue_wait'] >= self.seconds['read'] + self.seconds['write'] else 'io',
+        }
+
+    def write_summary(self, path):
+        """Write the summary as JSON to path ('-' for stderr)."""
+        text = json.dumps(self.summary(), indent=2)
+        if path == '-':
+            print(text, file=sys.stderr)
+        else:
+            with open(path, 'w') as f:
+                f.write(text + '\n')
+
+_DONE = object()  # End of items marker for timed_items
+
+def progress_bar(file=sys.stderr, width=30):
+    """
+    Return a Metrics callback redrawing a one-line progress bar on file (or a chunk counter when the total is unknown).
+    The caller ends the line once the job is done.
+    """
+    def draw(metrics):
+        wall = max(metrics.finished - metrics.started, 1e-9)
+        rate = (metrics.bytes_in if metrics.work == 'compress' else metrics.bytes_out) / (1024 * 1024) / wall
+        if metrics.total:
+            done = min(metrics.bytes_in / metrics.total, 1)
+            bar = '#' * int(done * width)
+            file.write(f"\r{metrics.work} [{bar:<{width}}] {done:6.1%} {metrics.chunks} chunks {rate:8.1f} MB/s")
+        else:
+            file.write(f"\r{metrics.work} {metrics.chunks} chunks {rate:8.1f} MB/s")
+        file.flush()
+    return draw
@@ -0,0 +1,145 @@
+# gcsv_tuning.py
+import os
+import json
+import time
+import socket
+import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from gcsv_codecs import available_codecs, get_codec
+
+# Settings picked by auto_settings, in the units of gcsv_compress / to_gcsv (chunk_size in MB)
+Tuning = namedtuple('Tuning', ['chunk_size', 'max_threads', 'level'])
+
+TARGETS = ('max_throughput', 'max_ratio')
+
+PROBE_SIZE = 4 * 1024 * 1024  # Bytes of input sampled by the probe
+PIECE_SIZE = 64 * 1024  # Size of the pieces compressed concurrently to measure how well threads scale
+
+# Chunk sizes tried by the probe (in MB); sizes larger than the sample can't be measured
+CHUNK_SIZES = (0.25, 1, 4, 10)
+
+# Levels tried by the probe, per codec (fast, default and strong)
+_PROBE_LEVELS = {
+    'zlib': (1, 6, 9), 'gzip': (1, 6, 9), 'lzma': (0, 3, 6), 'bz2': (1, 5, 9), 'zstd': (1, 3, 9, 19), 'lz4': (0, 3, 9),
+}
+
+# How far below the best measured ratio a smaller chunk size may fall and still be picked, per target
+_RATIO_TOLERANCE = {'max_throughput': 0.02, 'max_ratio': 0.005}
+
+# Settings are cached per host in a JSON file: {hostname: {"codec:target": {chunk_size, max_threads, level}}}
+TUNING_CACHE = os.environ.get('GCSV_TUNING_CACHE') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'gcsv', 'tuning.json')
+
+def auto_settings(sample, codec='zlib', target='max_throughput', input_size=None, cache=TUNING_CACHE):
+    """
+    Pick the chunk size, thread count and level for compressing with codec on this machine.
+    The settings are probed on sample (a few MB from the start of the input, see probe_settings) the first
+    time, then read back from the per-host cache file (pass cache=None to always probe).
+    With input_size (in bytes), max_throughput chunks are made small enough to give every thread a chunk.
+    :param target: 'max_throughput' (fastest level, most threads that still pay off) or 'max_ratio' (strongest level, large chunks).
+    :return: A Tuning(chunk_size, max_threads, level).
+    """
+    if target not in TARGETS:
+        raise ValueError(f"unknown tuning target {target!r} (expected one of {', '.join(TARGETS)})")
+
+    host, key = socket.gethostname(), f"{codec}:{target}"
+    cached = _load_cache(cache).get(host, {}).get(key) if cache else None
+    if cached:
+        settings = Tuning(**cached)
+    else:
+        settings = probe_settings(sample, codec, target)
+        if cache:
+            _save_cache(cache, host, key, settings)
+
+    if input_size and target == 'max_throughput':
+        spread = input_size / settings.max_threads / (1024 * 1024)
+        settings = settings._replace(chunk_size=max(min(settings.chunk_size, spread), CHUNK_SIZES[0]))
+    return settings
+
+def probe_settings(sample, codec='zlib', target='max_throughput'):
+    """
+    Measure the compression speed and ratio of sample on this machine and pick settings for target.
+    The level is the fastest (max_throughput) or the strongest (max_ratio) of a few candidates, timed on one thread.
+    The chunk size is the smallest one whose ratio is within a small tolerance of the largest measurable one.
+    The thread count is the smallest one reaching 90% of the best throughput measured for 1, 2, 4, ... up to the
+    usable cores, which catches hyperthreads and CPU quotas that a core count alone doesn't.
+    """
+    sample = bytes(sample) or b'\n'
+
+    # Level: single-threaded MB/s and ratio of the whole sample at every candidate level
+    levels = []
+    for level in _PROBE_LEVELS.get(codec, (None,)):
+        seconds, size = _timed_compress(get_codec(codec, level), [sample])
+        levels.append((len(sample) / seconds, len(sample) / size, level))
+    level = (max(levels) if target == 'max_throughput' else max(levels, key=lambda result: (result[1], result[0])))[2]
+    chunk_codec = get_codec(codec, level)
+
+    # Chunk size: the ratio of the sample cut into chunks of each size (every chunk starts with an empty window)
+    sizes = [size for size in CHUNK_SIZES if size * 1024 * 1024 <= len(sample)] or [CHUNK_SIZES[0]]
+    ratios = [len(sample) / _timed_compress(chunk_codec, _pieces(sample, int(size * 1024 * 1024)))[1] for size in sizes]
+    tolerance = _RATIO_TOLERANCE[target]
+    chunk_size = next(size for size, ratio in zip(sizes, ratios) if ratio >= ratios[-1] * (1 - tolerance))
+    if target == 'max_ratio' and chunk_size == sizes[-1]:
+        chunk_size = CHUNK_SIZES[-1]  # Still improving at the size of the sample, so go as large as the defaults
+
+    # Threads: throughput of the same work (4 pieces per usable core) on 1, 2, 4, ... threads
+    cores = usable_cores()
+    pieces = _pieces(sample, PIECE_SIZE)
+    pieces = [pieces[i % len(pieces)] for i in range(4 * cores)]
+    counts = sorted({min(1 << i, cores) for i in range(cores.bit_length() + 1)})
+    throughputs = [sum(map(len, pieces)) / _timed_compress(chunk_codec, pieces, threads)[0] for threads in counts]
+    max_threads = next(threads for threads, throughput in zip(counts, throughputs) if throughput >= 0.9 * max(throughputs))
+
+    return Tuning(chunk_size, max_threads, level)
+
+def usable_cores():
+    """Return the number of cores this process may run on (its CPU affinity where the OS reports one)."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def _pieces(data, size):
+    """Cut data into pieces of size bytes (the last one may be shorter)."""
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+def _timed_compress(codec, pieces, threads=1):
+    """Compress pieces on a pool of threads, returning (seconds taken, total compressed size)."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        size = sum(map(len, executor.map(codec.compress, pieces)))
+    return max(time.perf_counter() - start, 1e-9), size
+
+def _load_cache(path):
+    """Read the tuning cache file, treating a missing or damaged file as empty."""
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+def _save_cache(path, host, key, settings):
+    """Record settings in the tuning cache file (atomically, and silently skipped if the file can't be written)."""
+    cache = _load_cache(path)
+    cache.setdefault(host, {})[key] = settings._asdict()
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(f"{path}.{os.getpid()}.tmp", 'w') as f:
+            json.dump(cache, f, indent=2)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+    except OSError:
+        pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Probe this machine for the best GCSV compression settings on a sample of a CSV file and cache them.")
+    parser.add_argument("input_file", help="Path to a representative CSV file. (i.e bitcoin.csv)")
+    parser.add_argument("--codec", default="zlib", choices=available_codecs(), help="Compression codec to tune (i.e zlib)")
+    parser.add_argument("--target", default="max_throughput", choices=TARGETS, help="What to optimize for")
+    args = parser.parse_args()
+
+    with open(args.input_file, 'rb') as f:
+        probed = probe_settings(f.read(PROBE_SIZE), args.codec, args.target)
+    _save_cache(TUNING_CACHE, socket.gethostname(), f"{args.codec}:{args.target}", probed)
+    print(f"{socket.gethostname()} ({usable_cores()} cores), {args.codec} {args.target}: {probed.chunk_size} MB chunks, "
+          f"{probed.max_threads} threads, level {probed.level} (cached in {TUNING_CACHE})")
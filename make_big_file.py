@@ -2,37 +2,68 @@ import csv
 import argparse
 import random
 
-def generate_csv(file_path, size_in_mb):
-    words = [
-        'apple', 'banana', 'cherry', 'date', 'elderberry', 'fig', 'grape', 'honeydew', 'kiwi', 'lemon',
-        'mango', 'nectarine', 'orange', 'papaya', 'quince', 'raspberry', 'strawberry', 'tangerine', 'ugli', 'vanilla',
-        'watermelon', 'xigua', 'yellow', 'zucchini', 'apricot', 'blackberry', 'cantaloupe', 'dragonfruit', 'eggplant', 'feijoa',
-        'guava', 'huckleberry', 'imbe', 'jackfruit', 'kumquat', 'lime', 'mulberry', 'nutmeg', 'olive', 'peach',
-        'quinoa', 'rambutan', 'sapodilla', 'tamarind', 'ugni', 'voavanga', 'wolfberry', 'ximenia', 'yam', 'ziziphus'
-    ]
+WORDS = [
+    'apple', 'banana', 'cherry', 'date', 'elderberry', 'fig', 'grape', 'honeydew', 'kiwi', 'lemon',
+    'mango', 'nectarine', 'orange', 'papaya', 'quince', 'raspberry', 'strawberry', 'tangerine', 'ugli', 'vanilla',
+    'watermelon', 'xigua', 'yellow', 'zucchini', 'apricot', 'blackberry', 'cantaloupe', 'dragonfruit', 'eggplant', 'feijoa',
+    'guava', 'huckleberry', 'imbe', 'jackfruit', 'kumquat', 'lime', 'mulberry', 'nutmeg', 'olive', 'peach',
+    'quinoa', 'rambutan', 'sapodilla', 'tamarind', 'ugni', 'voavanga', 'wolfberry', 'ximenia', 'yam', 'ziziphus'
+]
 
-    with open(file_path, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(['Column1', 'Column2', 'Column3']) 
+# Dataset shapes: words (random fruit names), numeric (mnist-like label and pixel columns)
+# and mixed (bitcoin-like id, timestamp, price, word and quantity columns)
+SHAPES = ('words', 'numeric', 'mixed')
 
-        def generate_random_row():
-            return [random.choice(words) for _ in range(3)]
+def generate_csv(file_path, size_in_mb, shape='words', columns=None, seed=None):
+    """
+    Write a CSV file of about size_in_mb MB of random rows of the given shape.
+    :param columns: Number of columns of the words and numeric shapes (3 and 64 by default).
+    :param seed: Seed of the random rows, so the same arguments always generate the same file.
+    :return: Number of rows written (not counting the header).
+    """
+    if shape not in SHAPES:
+        raise ValueError(f"unknown shape {shape!r} (expected one of {', '.join(SHAPES)})")
+    rng = random.Random(seed)
 
-        row = generate_random_row()
-        row_size = sum(len(item) for item in row) + len(row) - 1  # approximate size of one row in bytes
+    if shape == 'words':
+        header = [f'Column{i + 1}' for i in range(columns or 3)]
+        def generate_random_row():
+            return [rng.choice(WORDS) for _ in header]
+    elif shape == 'numeric':
+        header = ['label'] + [f'pixel{i}' for i in range((columns or 64) - 1)]
+        def generate_random_row():
+            return [rng.randrange(10)] + [rng.randrange(256) if rng.random() < 0.3 else 0 for _ in header[1:]]
+    else:
+        header = ['id', 'Timestamp', 'Price', 'Item', 'Quantity']
+        state = {'id': 0, 'timestamp': 1609459200, 'price': 30000.0}
+        def generate_random_row():
+            state['id'] += 1
+            state['timestamp'] += rng.randrange(1, 60)
+            state['price'] = round(state['price'] * (1 + rng.gauss(0, 0.001)), 2)
+            return [state['id'], state['timestamp'], state['price'], rng.choice(WORDS), rng.randrange(1, 1000)]
 
-        num_rows = (size_in_mb * 1024 * 1024) // row_size
+    with open(file_path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(header)
 
-        for _ in range(num_rows):
+        # Write rows until the file reaches the requested size (csv.writer ends rows with \r\n)
+        size, target, num_rows = 0, size_in_mb * 1024 * 1024, 0
+        while size < target:
             row = generate_random_row()
             writer.writerow(row)
+            size += sum(len(str(item)) for item in row) + len(row) + 1
+            num_rows += 1
+    return num_rows
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Generate a CSV file of specified size.')
     parser.add_argument('output_file', type=str, help='The output CSV file name')
-    parser.add_argument('size_in_mb', type=int, help='The size of the CSV file in megabytes')
-    
+    parser.add_argument('size_in_mb', type=float, help='The size of the CSV file in megabytes')
+    parser.add_argument('--shape', choices=SHAPES, default='words', help='Kind of rows to generate')
+    parser.add_argument('--columns', type=int, default=None, help='Number of columns (words and numeric shapes)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed, the same arguments always generate the same file')
+
     args = parser.parse_args()
-    
-    generate_csv(args.output_file, args.size_in_mb)
-    print(f"CSV file '{args.output_file}' generated with size {args.size_in_mb} MB")
\ No newline at end of file
+
+    rows = generate_csv(args.output_file, args.size_in_mb, args.shape, args.columns, args.seed)
+    print(f"CSV file '{args.output_file}' generated with size {args.size_in_mb} MB ({rows} {args.shape} rows)")
@@ -1,99 +1,845 @@
 import pandas as pd
+import numpy as np
 import io
+import os
+import csv
 import zlib
+import operator
+import warnings
+from contextlib import nullcontext
+from functools import partial
+from urllib.parse import quote
 from concurrent.futures import ThreadPoolExecutor
+from gcsv_format import (
+    FLAG_COLUMNAR, FLAG_ROW_ALIGNED, appending, check_csv_header, count_rows, csv_chunk_stats, has_index, is_columnar, is_row_aligned, read_csv_header,
+    decompress_checked, iter_row_aligned, iter_with_last, load_for_append, map_file, map_ordered, read_file_header,
+    read_index, read_metadata, write_file_header, write_index, dataset_files,
+)
+from gcsv_cache import file_key
+from gcsv_codecs import get_codec, train_dictionary
+from gcsv_tuning import PROBE_SIZE, auto_settings, usable_cores
+from compress import compress_stream, compress_task
+from decompress import read_chunks, read_codec, read_indexed_chunks, read_rows
 
-def read_gcsv(gcsv_file: str, **kwargs) -> pd.DataFrame:
+# pd.read_csv arguments that depend on the position of a row in the whole file, which
+# per-chunk parsing can't honor (these fall back to a single parse of the joined data)
+_SERIAL_ONLY_KWARGS = {'header', 'skiprows', 'skipfooter', 'nrows', 'chunksize', 'iterator'}
+
+# Comparison operators accepted in filters (besides 'in' and 'not in')
+_FILTER_OPS = {
+    '==': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le,
+    '>': operator.gt, '>=': operator.ge,
+}
+
+def read_gcsv(gcsv_file: str, rows: slice = None, max_threads=4, chunksize=None, filters=None, on_bad_chunks='error', **kwargs):
     """
     Read a GCSV file into a pandas DataFrame.
+    Row-aligned files are decompressed and parsed chunk by chunk on a pool of threads,
+    then the per-chunk DataFrames are concatenated.
     :param gcsv_file: Path to the input GCSV file.
-    :param kwargs: Additional arguments passed to pd.DataFrame.
-    :return: pandas DataFrame.
+    :param rows: Optional slice of data rows to read (i.e slice(-1000, None) for the last 1000 rows).
+                 Only the chunks holding those rows are decompressed. Byte-aligned files count lines
+                 instead of rows, which differ when quoted fields hold line breaks. With chunksize,
+                 the rows of the slice are yielded chunksize at a time.
+    :param max_threads: Number of threads for decompression and parsing.
+    :param chunksize: Return an iterator of DataFrames instead, of chunksize rows each
+                      (or one per GCSV chunk with chunksize='chunk'), like pd.read_csv(chunksize=...).
+    :param filters: Keep only rows matching [(column, op, value), ...] (AND-ed), or a list of such
+                    lists (OR-ed), like pd.read_parquet. op is one of ==, !=, <, <=, >, >=, in, not in.
+                    Chunks whose recorded column statistics can't match are not decompressed at all.
+                    Filter columns left out of usecols are still read to filter the rows, then dropped.
+    :param on_bad_chunks: What to do with a chunk that fails to decompress or its length/CRC32 check, like
+                          pd.read_csv(on_bad_lines=...): 'error' raises a ValueError, 'warn' warns and skips
+                          its rows, 'skip' silently skips them. Skipping needs a row-aligned or columnar file.
+    :param kwargs: Additional arguments passed to pd.read_csv (only usecols for columnar files).
+    :return: pandas DataFrame (or an iterator of DataFrames when chunksize is given).
     """
-    decompressed_data = _decompress_gcsv_to_memory(gcsv_file)
+    filters = _normalize_filters(filters)
+    if on_bad_chunks not in ('error', 'warn', 'skip'):
+        raise ValueError(f"on_bad_chunks must be 'error', 'warn' or 'skip', not {on_bad_chunks!r}")
+    with open(gcsv_file, 'rb') as f:
+        columnar = is_columnar(f)
+        row_aligned = is_row_aligned(f)
+    if columnar:
+        return _read_gcsv_columnar(gcsv_file, rows, max_threads, chunksize, filters, on_bad_chunks, **kwargs)
+
+    # Filters may use columns left out of usecols (as with columnar files): they are parsed, then dropped
+    kwargs, extra = _add_filter_columns(gcsv_file, filters, kwargs)
+    if extra:
+        result = read_gcsv(gcsv_file, rows, max_threads, chunksize, filters, on_bad_chunks, **kwargs)
+        if chunksize is not None:
+            return (df.drop(columns=extra) for df in result)
+        return result.drop(columns=extra)
+
+    # Bad chunks can only be dropped where chunks hold whole rows and are parsed on their own
+    per_chunk = row_aligned and rows is None and not _serial_kwargs(kwargs)
+    if on_bad_chunks != 'error' and not per_chunk:
+        raise ValueError("skipping bad chunks requires a row-aligned GCSV file, no rows and per-chunk pd.read_csv arguments")
+
+    if chunksize is not None and rows is not None:
+        if chunksize == 'chunk':
+            raise ValueError("chunksize='chunk' yields whole GCSV chunks and can't be combined with rows")
+        return _iter_gcsv_rows(gcsv_file, rows, chunksize, max_threads, filters, **kwargs)
+
+    if chunksize is not None:
+        return _iter_gcsv(gcsv_file, chunksize, max_threads, filters, on_bad_chunks, **kwargs)
+
+    if rows is not None:
+        df = pd.read_csv(io.StringIO(_read_gcsv_rows(gcsv_file, rows, max_threads)), **kwargs)
+        return _apply_filters(df, filters, 'index_col' not in kwargs)
+
+    if per_chunk:
+        return _read_gcsv_parallel(gcsv_file, max_threads, filters, on_bad_chunks, **kwargs)
+
+    decompressed_data = _decompress_gcsv_to_memory(gcsv_file, max_threads)
 
     # Use io.StringIO to simulate a file-like object from the decompressed string
-    return pd.read_csv(io.StringIO(decompressed_data), **kwargs)
+    df = pd.read_csv(io.StringIO(decompressed_data), **kwargs)
+    return _apply_filters(df, filters, 'index_col' not in kwargs)
 
-def _decompress_gcsv_to_memory(gcsv_file: str, max_threads=4) -> str:
+def read_gcsv_numpy(gcsv_file: str, dtype=np.float64, max_threads=4) -> np.ndarray:
     """
-    Decompress the GCSV file into a string using multithreading.
-    This function reads the compressed chunks and decompresses them in memory.
+    Read an all-numeric, row-aligned GCSV file (i.e mnist.gcsv) straight into a 2D NumPy array.
+    The array is preallocated from the row counts of the chunk index and every chunk is decompressed and
+    parsed from bytes into its own slice of it on the thread pool, without going through str, pandas'
+    CSV tokenizer or a final concat.
+    Values must be plain comma-separated numbers (no quoting or missing values), use read_gcsv otherwise.
+    :param gcsv_file: Path to the input GCSV file.
+    :param dtype: dtype of the returned array.
+    :param max_threads: Number of threads for decompression and parsing.
+    :return: Array of shape (data rows, columns), the CSV header excluded.
+    """
+    with open(gcsv_file, 'rb') as f:
+        if is_columnar(f) or not is_row_aligned(f):
+            raise ValueError("read_gcsv_numpy needs a row-aligned GCSV file (written without --byte-aligned)")
+        index = read_index(f)
+        if not index:
+            return np.empty((0, 0), dtype=dtype)
+        codec, _ = read_file_header(f)
+        header = _read_header_chunk(f, index)
+        key = file_key(f)
+        view = map_file(f)
+
+    columns = len(pd.read_csv(io.BytesIO(header), nrows=0).columns)
+    header_rows = index[0].rows
+    out = np.empty((index[-1].row_offset + index[-1].rows - header_rows, columns), dtype=dtype)
+
+    # Values are parsed as 64-bit numbers and range-checked, as parsing straight into a small dtype wraps them (300 -> 44 in uint8)
+    wide = np.dtype(np.uint64 if out.dtype == np.uint64 else np.int64 if out.dtype.kind in 'iu' else np.float64)
+    limits = np.iinfo(out.dtype) if out.dtype.kind in 'iu' else np.finfo(out.dtype) if out.dtype.kind == 'f' else None
+
+    def parse_into(entry):
+        # Parse the chunk (a zero-copy slice of the mapped file) as one flat run of comma-separated values
+        chunk = decompress_checked(codec, view[entry.offset:entry.offset + entry.length], entry, key)
+        lines = f"lines {entry.row_offset}-{entry.row_offset + entry.rows - 1}"
+        error = f"{lines} aren't {columns} plain numbers each, use read_gcsv instead"
+        try:
+            values = np.fromstring(chunk.replace(b'\n', b','), dtype=wide, sep=',')
+        except ValueError as e:
+            raise ValueError(error) from e
+        if values.size != entry.rows * columns:
+            raise ValueError(error)
+        finite = values[np.isfinite(values)] if wide.kind == 'f' else values
+        if limits is not None and finite.size and (finite.min() < limits.min or finite.max() > limits.max):
+            raise ValueError(f"{lines} hold values outside the range of {out.dtype} ({finite.min()} to {finite.max()})")
+        start = entry.row_offset - header_rows
+        out[start:start + entry.rows] = values.reshape(entry.rows, columns)
+
+    with ThreadPoolExecutor(max_workers=max_threads) as executor:
+        for _ in executor.map(parse_into, [entry for entry in index[1:] if entry.rows]):
+            pass  # Re-raise any parsing error
+    return out
+
+def read_gcsv_dataset(glob_or_dir: str, max_threads=None, filters=None, on_bad_chunks='error', max_in_flight=None, **kwargs) -> pd.DataFrame:
+    """
+    Read a multi-file dataset (i.e one GCSV file per day, or the partitions written by to_gcsv(partition_by=...))
+    into one DataFrame. The data chunks of every row-aligned file go through a single pool of max_threads threads,
+    so many small files keep every core busy instead of being read one after the other; the frames are concatenated
+    in file (sorted path) then chunk order, so the result doesn't depend on thread timing.
+    Other files (columnar or byte-aligned ones, or with serial pd.read_csv arguments) are read whole by one worker each.
+    :param glob_or_dir: A directory (every .gcsv file under it) or a glob pattern (i.e 'exports/2024-*.gcsv').
+    :param max_threads: Number of threads shared by all the files (defaults to the usable cores).
+    :param filters: Keep only rows matching the filters (see read_gcsv); chunks ruled out by their statistics are skipped.
+    :param on_bad_chunks: 'error', 'warn' or 'skip' (see read_gcsv).
+    :param max_in_flight: Maximum number of chunks decompressed ahead across all files (defaults to 2 x max threads).
+    :param kwargs: Additional arguments passed to pd.read_csv (or read_gcsv for files read whole).
+    :return: pandas DataFrame.
+    """
+    files = dataset_files(glob_or_dir)
+    if not files:
+        raise ValueError(f"no GCSV files found in {glob_or_dir}")
+    filters = _normalize_filters(filters)
+    if on_bad_chunks not in ('error', 'warn', 'skip'):
+        raise ValueError(f"on_bad_chunks must be 'error', 'warn' or 'skip', not {on_bad_chunks!r}")
+
+    def tasks():
+        # Files are opened lazily, as the pool's window reaches them
+        for path in files:
+            with open(path, 'rb') as f:
+                per_chunk = is_row_aligned(f) and not is_columnar(f) and not _serial_kwargs(kwargs)
+            if per_chunk:
+                parse, entries = _chunk_parser(path, filters, on_bad_chunks, **kwargs)
+                yield from (partial(parse, entry) for entry in entries)
+            else:
+                yield partial(read_gcsv, path, max_threads=1, filters=filters, on_bad_chunks=on_bad_chunks, **kwargs)
+
+    frames = [df for df in map_ordered(_run_task, tasks(), max_threads or usable_cores(), max_in_flight) if df is not None]
+    if not frames:
+        return read_gcsv(files[0], max_threads=1, filters=filters, on_bad_chunks=on_bad_chunks, **kwargs)
+    return pd.concat(frames, ignore_index='index_col' not in kwargs)
+
+def _run_task(task):
+    return task()
+
+def _read_gcsv_parallel(gcsv_file: str, max_threads=4, filters=None, on_bad_chunks='error', **kwargs) -> pd.DataFrame:
+    """
+    Decompress and parse each row-aligned chunk into its own DataFrame on a thread pool,
+    then concatenate them.
+    """
+    frames = list(_iter_chunk_frames(gcsv_file, max_threads, filters, on_bad_chunks, **kwargs))
+    if not frames:
+        with open(gcsv_file, 'rb') as f:
+            header = _read_header_chunk(f, read_index(f))
+        return _apply_filters(pd.read_csv(io.BytesIO(header), **kwargs), filters)
+    return pd.concat(frames, ignore_index='index_col' not in kwargs)
+
+def _iter_chunk_frames(gcsv_file: str, max_threads=4, filters=None, on_bad_chunks='error', **kwargs):
+    """
+    Yield one DataFrame per data chunk of a row-aligned file, decompressed and parsed ahead on a thread pool.
+    Chunks whose column statistics rule out the filters are skipped without being read,
+    and bad chunks are skipped as well unless on_bad_chunks is 'error'.
+    """
+    parse, entries = _chunk_parser(gcsv_file, filters, on_bad_chunks, **kwargs)
+    for df in map_ordered(parse, entries, max_threads):
+        if df is not None:
+            yield df
+
+def _chunk_parser(gcsv_file: str, filters=None, on_bad_chunks='error', **kwargs):
+    """
+    Return (parse, entries) for reading a row-aligned file chunk by chunk: parse(entry) decompresses and parses
+    the data chunk of an index entry into a DataFrame (None for a skipped bad chunk), entries are the data chunks
+    that may match the filters. Chunk 0 holds the CSV header, which is prepended to every other chunk before parsing.
+    """
+    with open(gcsv_file, 'rb') as f:
+        index = read_index(f)
+        if not index:
+            return None, []
+        codec, _ = read_file_header(f)
+        header = _read_header_chunk(f, index)
+
+        # A chunk without rows holds only the newline an append put after a last row that had none
+        entries = [entry for entry in index[1:] if entry.rows and _chunk_may_match(entry.stats, filters)]
+        key = file_key(f)
+        view = map_file(f)
+    kwargs, extra = _add_filter_columns(gcsv_file, filters, kwargs)
+
+    def parse(entry):
+        # Workers decompress zero-copy slices of the mapped file (or take the chunk from the cache)
+        chunk = _decompress_entry(codec, view[entry.offset:entry.offset + entry.length], entry, on_bad_chunks, key)
+        if chunk is None:
+            return None
+        df = _parse_chunk(header, chunk, filters, **kwargs)
+        return df.drop(columns=extra) if extra else df
+
+    return parse, entries
+
+def _read_header_chunk(f, index) -> bytes:
+    """
+    Read and decompress chunk 0 (the CSV header line of a row-aligned file).
+    An empty file has no header chunk, which raises pd.errors.EmptyDataError as pd.read_csv does.
+    """
+    if not index:
+        raise pd.errors.EmptyDataError("No columns to parse from file")
+    codec, _ = read_file_header(f)
+    f.seek(index[0].offset)
+    return decompress_checked(codec, f.read(index[0].length), index[0], file_key(f))
+
+def _decompress_entry(codec, compressed_chunk, entry, on_bad_chunks='error', key=None):
+    """
+    Decompress a chunk and check it against its index entry (through the chunk cache with the file's key).
+    A bad chunk raises with on_bad_chunks='error', otherwise None is returned (after a warning with 'warn').
+    """
+    try:
+        return decompress_checked(codec, compressed_chunk, entry, key)
+    except ValueError as e:
+        if on_bad_chunks == 'error':
+            raise
+        if on_bad_chunks == 'warn':
+            warnings.warn(f"skipping a bad chunk: {e}")
+        return None
+
+def _serial_kwargs(kwargs) -> set:
+    """
+    Return the pd.read_csv arguments in kwargs that per-chunk parsing can't honor. Every chunk is parsed behind
+    the CSV header line, which is only right while pandas reads that line as the header: header=0, or no header
+    and no names (names alone makes it header=None, so the header line is a data row, once).
+    """
+    serial = _SERIAL_ONLY_KWARGS.intersection(kwargs) - {'header'}
+    header = kwargs.get('header', 'infer')
+    if not ((isinstance(header, int) and header == 0) or (header == 'infer' and kwargs.get('names') is None)):
+        serial.add('header' if 'header' in kwargs else 'names')
+    return serial
+
+def _parse_chunk(header_line: bytes, chunk: bytes, filters=None, **kwargs) -> pd.DataFrame:
+    """
+    Parse a decompressed row-aligned chunk (behind the CSV header line) into a DataFrame.
+    """
+    df = pd.read_csv(io.BytesIO(header_line + chunk), **kwargs)
+    return _apply_filters(df, filters)
+
+def _add_filter_columns(gcsv_file: str, filters, kwargs):
+    """
+    Add the columns the filters need to a usecols argument that leaves them out (by name, position or callable),
+    so the rows can be filtered on them.
+    :return: (kwargs, the added columns to drop once the rows are filtered).
+    """
+    usecols = kwargs.get('usecols')
+    if usecols is None or filters is None:
+        return kwargs, []
+    needed = list(dict.fromkeys(column for group in filters for column, _, _ in group))
+
+    if callable(usecols):
+        extra = [column for column in needed if not usecols(column)]
+        return ({**kwargs, 'usecols': lambda column: usecols(column) or column in extra}, extra) if extra else (kwargs, [])
+
+    usecols = list(usecols)
+    if usecols and all(isinstance(column, (int, np.integer)) for column in usecols):
+        # Positions: look the filter columns up in the CSV header line, named as pd.read_csv will name them
+        with open(gcsv_file, 'rb') as f:
+            header_line = read_csv_header(f, read_index(f), read_file_header(f)[0])
+        header_kwargs = {name: kwargs[name] for name in ('sep', 'delimiter', 'quotechar', 'header', 'names') if name in kwargs}
+        columns = list(pd.read_csv(io.BytesIO(header_line), nrows=0, **header_kwargs).columns)
+        extra = [column for column in needed if column in columns and columns.index(column) not in usecols]
+        return ({**kwargs, 'usecols': usecols + [columns.index(column) for column in extra]}, extra) if extra else (kwargs, [])
+
+    extra = [column for column in needed if column not in usecols]
+    return ({**kwargs, 'usecols': usecols + extra}, extra) if extra else (kwargs, [])
+
+def _normalize_filters(filters):
+    """
+    Return filters as a list of AND-ed predicate lists that are OR-ed together (or None for no filters).
+    """
+    if not filters:
+        return None
+    if isinstance(filters[0], tuple):
+        return [list(filters)]
+    return [list(group) for group in filters]
+
+def _chunk_may_match(stats: dict, filters) -> bool:
+    """
+    Return False only when a chunk's column statistics prove none of its rows can match the filters.
+    """
+    if stats is None or filters is None:
+        return True
+    return any(all(_predicate_may_match(stats.get(str(column)), op, value) for column, op, value in group) for group in filters)
+
+def _predicate_may_match(column_stats, op: str, value) -> bool:
+    """
+    Check a single (op, value) predicate against a column's [min, max, null count].
+    """
+    if op not in _FILTER_OPS and op not in ('in', 'not in'):
+        raise ValueError(f"unsupported filter operator: {op}")
+    if column_stats is None:
+        return True
+    low, high, nulls = column_stats
+    if low is None:
+        return op in ('!=', 'not in')  # Only missing values in this chunk
+
+    try:
+        if op == '==':
+            return low <= value <= high
+        if op == '!=':
+            return not (low == high == value and nulls == 0)
+        if op == '<':
+            return low < value
+        if op == '<=':
+            return low <= value
+        if op == '>':
+            return high > value
+        if op == '>=':
+            return high >= value
+        if op == 'in':
+            return any(low <= item <= high for item in value)
+        return not (low == high and low in value and nulls == 0)  # 'not in'
+    except TypeError:
+        return True  # Statistics and value aren't comparable, so the chunk can't be ruled out
+
+def _apply_filters(df: pd.DataFrame, filters, renumber=False) -> pd.DataFrame:
+    """
+    Keep the rows of df matching the filters (optionally renumbering the index from 0).
+    """
+    if filters is None:
+        return df
+
+    mask = pd.Series(False, index=df.index)
+    for group in filters:
+        group_mask = pd.Series(True, index=df.index)
+        for column, op, value in group:
+            if column not in df:
+                raise ValueError(f"filter column {column!r} is not in the DataFrame (check usecols)")
+            if op == 'in':
+                group_mask &= df[column].isin(value)
+            elif op == 'not in':
+                group_mask &= ~df[column].isin(value)
+            else:
+                group_mask &= _FILTER_OPS[op](df[column], value)
+        mask |= group_mask
+
+    df = df[mask]
+    return df.reset_index(drop=True) if renumber else df
+
+def _iter_gcsv(gcsv_file: str, chunksize, max_threads=4, filters=None, on_bad_chunks='error', **kwargs):
+    """
+    Yield DataFrames of chunksize rows (or one per GCSV chunk with chunksize='chunk').
+    Chunks are decompressed and parsed ahead on the thread pool while earlier DataFrames are consumed,
+    so only a bounded window of chunks is ever held in memory.
     """
-    decompressed_data = []
+    with open(gcsv_file, 'rb') as f:
+        row_aligned = is_row_aligned(f)
+
+    if not row_aligned or _serial_kwargs(kwargs):
+        if chunksize == 'chunk':
+            raise ValueError("chunksize='chunk' requires a row-aligned GCSV file and per-chunk pd.read_csv arguments")
+
+        # Stream the decompressed bytes through a single pd.read_csv reader
+        codec = read_codec(gcsv_file)
+        index, chunks = read_indexed_chunks(gcsv_file)
+        if index is None:
+            decompressed = map_ordered(codec.decompress, chunks, max_threads)  # Nothing to check chunks against
+        else:
+            decompressed = map_ordered(lambda item: decompress_checked(codec, *item), zip(chunks, index), max_threads)
+        stream = io.BufferedReader(_DecompressedStream(decompressed))
+        with pd.read_csv(stream, chunksize=chunksize, **kwargs) as reader:
+            for df in reader:
+                yield _apply_filters(df, filters)
+        return
+
+    frames = _iter_chunk_frames(gcsv_file, max_threads, filters, on_bad_chunks, **kwargs)
+    yield from _rebatch(_carry_schema(frames, 'index_col' not in kwargs), chunksize)
+
+def _iter_gcsv_rows(gcsv_file: str, rows: slice, chunksize, max_threads=4, filters=None, **kwargs):
+    """
+    Yield DataFrames of chunksize rows out of a slice of data rows (only the chunks holding them are decompressed).
+    """
+    with pd.read_csv(io.StringIO(_read_gcsv_rows(gcsv_file, rows, max_threads)), chunksize=chunksize, **kwargs) as reader:
+        for df in reader:
+            yield _apply_filters(df, filters)
+
+def _rebatch(frames, chunksize):
+    """
+    Regroup per-chunk DataFrames into DataFrames of exactly chunksize rows (as is with chunksize='chunk').
+    """
+    if chunksize == 'chunk':
+        yield from frames
+        return
 
+    buffer, buffered = [], 0
+    for frame in frames:
+        buffer.append(frame)
+        buffered += len(frame)
+        while buffered >= chunksize:
+            merged = pd.concat(buffer) if len(buffer) > 1 else buffer[0]
+            yield merged.iloc[:chunksize]
+            buffer, buffered = [merged.iloc[chunksize:]], buffered - chunksize
+    if buffered:
+        yield pd.concat(buffer) if len(buffer) > 1 else buffer[0]
+
+def _read_gcsv_columnar(gcsv_file: str, rows: slice = None, max_threads=4, chunksize=None, filters=None, on_bad_chunks='error',
+                        usecols=None, **kwargs):
+    """
+    Read a columnar GCSV file, decompressing and parsing only the requested columns on a thread pool.
+    Row groups whose column statistics rule out the filters are skipped.
+    """
+    if rows is not None or kwargs:
+        raise ValueError("columnar GCSV files only support the usecols, filters and chunksize arguments")
+
+    frames = _iter_columnar_frames(gcsv_file, max_threads, filters, usecols, on_bad_chunks)
+    if chunksize is not None:
+        return _rebatch(_carry_schema(frames), chunksize)
+    return pd.concat(list(frames), ignore_index=True)
+
+def _iter_columnar_frames(gcsv_file: str, max_threads=4, filters=None, usecols=None, on_bad_chunks='error'):
+    """
+    Yield one DataFrame per row group of a columnar file, holding only the requested columns.
+    Row groups with a bad column chunk are skipped unless on_bad_chunks is 'error'.
+    """
     with open(gcsv_file, 'rb') as f:
-        with ThreadPoolExecutor(max_workers=max_threads) as executor:
-            futures = []
-            while True:
-                size_data = f.read(4)  # Read the chunk header (4 bytes)
-                if not size_data:
-                    break  # No more chunks to read
+        index = read_index(f)
+        metadata = read_metadata(f)
+        codec, _ = read_file_header(f)
+        columns, dtypes = metadata['columns'], metadata['dtypes']
+
+        # Columns to decompress: the requested ones plus any the filters need
+        wanted = [columns[column] if isinstance(column, int) else column for column in (usecols if usecols is not None else columns)]
+        filter_columns = [column for group in filters or [] for column, _, _ in group]
+        needed = list(dict.fromkeys(wanted + filter_columns))
+        unknown = [column for column in needed if column not in columns]
+        if unknown:
+            raise ValueError(f"columns not in the GCSV file: {unknown}")
+        positions = [columns.index(column) for column in needed]
+
+        # Chunks are stored row group by row group, one chunk per column
+        groups = []
+        for start in range(0, len(index), len(columns)):
+            entries = index[start:start + len(columns)]
+            group_stats = {}
+            for entry in entries:
+                group_stats.update(entry.stats or {})
+            if _chunk_may_match(group_stats or None, filters):
+                groups.append([entries[position] for position in positions])
 
-                chunk_size = int.from_bytes(size_data, 'big')  # chunk size
-                compressed_chunk = f.read(chunk_size)
+        key = file_key(f)
+        view = map_file(f)
 
-                # Submit the decompression task for each chunk
-                futures.append(executor.submit(decompress_chunk, compressed_chunk))
+    def parse(item):
+        # Workers decompress zero-copy slices of the mapped file (or take the chunk from the cache)
+        entry, position = item
+        chunk = _decompress_entry(codec, view[entry.offset:entry.offset + entry.length], entry, on_bad_chunks, key)
+        return _parse_column(chunk, columns[position], dtypes[position]) if chunk is not None else None
 
-            # Gather the decompressed chunks and combine them
-            for future in futures:
-                decompressed_data.append(future.result())
+    items = ((entry, position) for entries in groups for entry, position in zip(entries, positions))
+    series = map_ordered(parse, items, max_threads)
+    for _ in groups:
+        group = [next(series) for _ in positions]
+        if any(column is None for column in group):
+            continue
+        df = pd.concat(group, axis=1)
+        yield _apply_filters(df, filters)[wanted]
 
-    return ''.join(decompressed_data)
+    if not groups:
+        yield pd.DataFrame({column: pd.Series(dtype=dtypes[columns.index(column)]) for column in wanted})
 
-def decompress_chunk(compressed_chunk: bytes) -> str:
+def _parse_column(chunk: bytes, name: str, dtype: str) -> pd.Series:
+    """
+    Parse a decompressed single-column chunk, restoring the column's original dtype where the values allow it.
+    """
+    text_like = dtype in ('object', 'str', 'string', 'category') or dtype.startswith('datetime64')
+    data = io.BytesIO(chunk)
+    column = pd.read_csv(data, header=None, names=[name], skip_blank_lines=False, dtype=str if text_like else None)[name]
+
+    if str(column.dtype) != dtype and dtype not in ('object', 'str', 'string'):
+        try:
+            column = pd.to_datetime(column).astype(dtype) if dtype.startswith('datetime64') else column.astype(dtype)  # Keeps the unit too
+        except (ValueError, TypeError):
+            pass  # Keep the inferred dtype (i.e NaNs in a column that was all integers so far)
+    return column
+
+def _carry_schema(frames, renumber=True):
+    """
+    Give every per-chunk DataFrame the dtypes of the first one (where its values convert without loss)
+    and, with renumber, a RangeIndex that continues from the previous chunk (see _SchemaCarrier).
+    """
+    return map(_SchemaCarrier(renumber), frames)
+
+class _SchemaCarrier:
+    """
+    Callable conforming per-chunk DataFrames, passed to it in order, to the first one (see _carry_schema).
+    """
+    def __init__(self, renumber=True):
+        self.renumber = renumber
+        self._dtypes = None
+        self._start = 0
+
+    def __call__(self, frame: pd.DataFrame) -> pd.DataFrame:
+        if self._dtypes is None:
+            self._dtypes = frame.dtypes
+        for column, dtype in self._dtypes.items():
+            if column in frame and frame[column].dtype != dtype:
+                frame[column] = _cast_lossless(frame[column], dtype)
+
+        if self.renumber:
+            frame.index = pd.RangeIndex(self._start, self._start + len(frame))
+            self._start += len(frame)
+        return frame
+
+def _cast_lossless(values: pd.Series, dtype) -> pd.Series:
+    """
+    Return values cast to dtype when casting them back gives the same values, or values as they are
+    (i.e 99997.5 stays a float in a column that was all integers so far, and so do NaNs).
+    """
+    try:
+        cast = values.astype(dtype)
+        if cast.astype(values.dtype).equals(values):
+            return cast
+    except (ValueError, TypeError, OverflowError):
+        pass
+    return values
+
+class _DecompressedStream(io.RawIOBase):
+    """
+    Read-only file-like object over an iterator of decompressed chunks.
+    """
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._current = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._current:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._current = memoryview(chunk)
+
+        size = min(len(buffer), len(self._current))
+        buffer[:size] = self._current[:size]
+        self._current = self._current[size:]
+        return size
+
+def _read_gcsv_rows(gcsv_file: str, rows: slice, max_threads=4) -> str:
+    """
+    Decompress the CSV header plus a slice of data rows into a string.
+    """
+    if rows.step not in (None, 1):
+        raise ValueError("rows only supports contiguous slices (step of 1)")
+
+    with open(gcsv_file, 'rb') as f:
+        index = read_index(f)
+    total_rows = max(index[-1].row_offset + index[-1].rows - 1, 0) if index else 0  # Data rows, excluding the header
+    start, stop, _ = rows.indices(total_rows)
+
+    # Line 0 is the header, so data row i is line i + 1
+    header = read_rows(gcsv_file, 0, 1, max_threads)
+    body = read_rows(gcsv_file, start + 1, stop + 1, max_threads)
+    return (header + body).decode('utf-8')
+
+def _decompress_gcsv_to_memory(gcsv_file: str, max_threads=4) -> str:
+    """
+    Decompress the GCSV file into a string using multithreading.
+    This function looks the chunks up in the chunk index and decompresses them in memory
+    (or takes them from the chunk cache), joining the bytes before decoding them.
+    Files without an index have their chunks walked header by header instead, unchecked and uncached.
+    """
+    with open(gcsv_file, 'rb') as f:
+        index = read_index(f) if has_index(f) else None
+        codec, _ = read_file_header(f)
+        key = file_key(f)
+        view = map_file(f)
+
+    def decompress(entry):
+        # Workers decompress zero-copy slices of the mapped file
+        return decompress_checked(codec, view[entry.offset:entry.offset + entry.length], entry, key)
+
+    with ThreadPoolExecutor(max_workers=max_threads) as executor:
+        if index is None:
+            chunks = (chunk_data for _, chunk_data in read_chunks(gcsv_file))
+            return b''.join(executor.map(codec.decompress, chunks)).decode('utf-8')
+        return b''.join(executor.map(decompress, index)).decode('utf-8')
+
+def decompress_chunk(compressed_chunk: bytes, codec=None) -> str:
     """
     Decompress a single chunk of data.
     :param compressed_chunk: Compressed chunk of data.
+    :param codec: Codec of the chunk (zlib when omitted).
     :return: Decompressed string.
     """
-    return zlib.decompress(compressed_chunk).decode('utf-8')
+    return (codec or get_codec()).decompress(compressed_chunk).decode('utf-8')
 
-def to_gcsv(df: pd.DataFrame, gcsv_file: str, chunk_size=10, max_threads=16, **kwargs):
+def to_gcsv(df: pd.DataFrame, gcsv_file: str, chunk_size=10, max_threads=16, row_aligned=True, max_in_flight=None, stats=False, layout='row',
+            codec='zlib', level=None, mode='w', dictionary=False, auto=None, metrics=None, partition_by=None, **kwargs):
     """
     Write a pandas DataFrame to a GCSV file with compression.
+    The frame is rendered to CSV in row batches of about chunk_size MB on the compression threads,
+    so formatting overlaps with compression and the full CSV text is never built in memory.
     :param df: pandas DataFrame to write.
     :param gcsv_file: Path to the output GCSV file.
     :param chunk_size: Chunk size in MB for compression.
-    :param max_threads: Number of threads for compression.
-    :param kwargs: Additional arguments passed to DataFrame.to_csv.
+    :param max_threads: Number of threads for formatting and compression.
+    :param row_aligned: Store the CSV header as its own chunk so read_gcsv can parse chunks in parallel.
+    :param max_in_flight: Maximum number of batches held in memory at once (defaults to 2 x max threads).
+    :param stats: Record per-chunk column min/max/null counts so read_gcsv(filters=...) can skip chunks.
+    :param layout: 'row' (CSV text, chunk after chunk) or 'columnar' (row groups with every column
+                   compressed separately, so read_gcsv(usecols=...) only decompresses those columns).
+    :param codec: Compression codec (zlib, lzma, bz2, or zstd/lz4 when installed). gzip writes every chunk as a gzip
+                  member, so the file is also a valid .gz (no stats or columnar layout).
+    :param level: Compression level of the codec (defaults to the codec's default level).
+    :param dictionary: Share a preset dictionary, trained on the first rows, between all chunks (zlib only),
+                       so small chunks compress about as well as large ones.
+    :param mode: 'w' to write a new file, or 'a' to append the rows to an existing file with the same
+                 header (or columns and dtypes) without recompressing it. Appended chunks keep the
+                 file's codec, chunking and layout. A missing file is written as with 'w'.
+    :param auto: 'max_throughput' or 'max_ratio' to replace chunk_size, max_threads and level by settings probed
+                 on the first few MB of the rendered CSV on this machine (cached per host, see gcsv_tuning).
+    :param metrics: gcsv_metrics.Metrics collecting stage timings, bytes in and out and progress (formatting
+                    the rows counts as compress time).
+    :param partition_by: Column name (or list of names) to split the frame on: gcsv_file is then a directory holding
+                         one file per value, <column>=<value>.gcsv (nested directories for several columns), which
+                         keeps the column and is read back with read_gcsv_dataset. The partitions are written
+                         concurrently, sharing max_threads; with mode='a' each one is appended to its existing file.
+    :param kwargs: Additional arguments passed to DataFrame.to_csv (row layout only).
+    :return: The paths of the written files with partition_by (None otherwise).
     """
-    # Write the DataFrame to a memory buffer (in CSV format)
-    csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False, **kwargs)
+    if mode not in ('w', 'a'):
+        raise ValueError(f"unknown mode: {mode}")
+    if partition_by is not None:
+        write = partial(to_gcsv, chunk_size=chunk_size, row_aligned=row_aligned, max_in_flight=max_in_flight, stats=stats, layout=layout,
+                        codec=codec, level=level, mode=mode, dictionary=dictionary, auto=auto, metrics=metrics, **kwargs)
+        return _to_gcsv_partitioned(df, gcsv_file, partition_by, max_threads, write)
+    append = mode == 'a' and os.path.exists(gcsv_file) and os.path.getsize(gcsv_file) > 0
+    if auto:
+        # Render about PROBE_SIZE bytes of rows for the probe, and estimate the size of the whole CSV from them
+        row_bytes = max(len(df.iloc[:1000].to_csv(index=False, header=False).encode('utf-8')) / max(min(len(df), 1000), 1), 1)
+        sample = df.iloc[:int(PROBE_SIZE // row_bytes) + 1].to_csv(index=False).encode('utf-8')
+        chunk_size, max_threads, level = auto_settings(sample, codec, auto, int(row_bytes * len(df)))
+    chunk_codec = get_codec(codec, level)
+    if dictionary:
+        chunk_codec = get_codec(codec, level, train_dictionary(df.iloc[:1000].to_csv(index=False).encode('utf-8')))
+    if codec == 'gzip' and (stats or layout == 'columnar'):
+        raise ValueError("gzip GCSV files have no room for column statistics or the columnar layout")
+    if metrics is not None:
+        metrics.info.update(codec=chunk_codec.name, level=chunk_codec.level, chunk_size_mb=chunk_size, layout=layout)
+    if layout == 'columnar':
+        if kwargs:
+            raise ValueError("layout='columnar' does not take DataFrame.to_csv arguments")
+        return _to_gcsv_columnar(df, gcsv_file, chunk_size, max_threads, max_in_flight, stats, chunk_codec, append, metrics)
+    if layout != 'row':
+        raise ValueError(f"unknown layout: {layout}")
+
+    header = kwargs.pop('header', True)
+    header_line = df.iloc[:0].to_csv(index=False, header=header, **kwargs).encode('utf-8')
+    row_aligned = row_aligned and bool(header_line)
+    # Statistics are computed from the rendered rows, so they hold the values as written (i.e dates as text)
+    sep = kwargs.get('sep', ',')
+    columns = next(csv.reader([header_line.decode('utf-8')], delimiter=sep), [])
+
+    # Estimate how many rows fill a chunk from a small rendered sample
+    sample_rows = min(len(df), 1000)
+    sample = df.iloc[:sample_rows].to_csv(index=False, header=False, **kwargs).encode('utf-8')
+    batch_rows = int(max((chunk_size * 1024 * 1024) // max(len(sample) // max(sample_rows, 1), 1), 1))
 
-    # Now compress the CSV buffer content directly to the GCSV file
-    csv_data = csv_buffer.getvalue()
-    gcsv_compress_from_memory(csv_data, gcsv_file, chunk_size=chunk_size, max_threads=max_threads)
+    # Work items are (start row, stop row, bytes to prepend): the header goes in its own chunk when
+    # row-aligned, otherwise in front of the first batch (appended rows go after a header already in the file)
+    batches = [(start, min(start + batch_rows, len(df)), b'') for start in range(0, len(df), batch_rows)]
+    if not append and (row_aligned or not batches):
+        batches.insert(0, (0, 0, header_line))
+    elif not append:
+        batches[0] = (batches[0][0], batches[0][1], header_line)
 
-def gcsv_compress_from_memory(csv_data: str, gcsv_file: str, chunk_size=10, max_threads=16):
+    def compress_batch(item):
+        (start, stop, prefix), is_last = item
+        batch = df.iloc[start:stop]
+        data = prefix + batch.to_csv(index=False, header=False, **kwargs).encode('utf-8') if stop > start else prefix
+        batch_stats = csv_chunk_stats(columns, data, sep) if stats and row_aligned and stop > start and chunk_codec.name != 'gzip' else None
+        return chunk_codec.compress(data), len(data), count_rows(data, is_last, row_aligned), batch_stats, zlib.crc32(data)
+
+    with open(gcsv_file, 'r+b' if append else 'wb') as f_out:
+        index, flags, metadata = [], FLAG_ROW_ALIGNED if row_aligned else 0, None
+        guard = nullcontext()
+        if append:
+            chunk_codec, index, flags, metadata = load_for_append(f_out)
+            if flags & FLAG_COLUMNAR:
+                raise ValueError("can't append layout='row' data to a columnar GCSV file")
+            if header_line:
+                check_csv_header(f_out, index, chunk_codec, header_line)
+            row_aligned = bool(flags & FLAG_ROW_ALIGNED)  # New chunks follow the file's chunking
+            guard = appending(f_out, chunk_codec, index)  # A failed append puts the file back as it was
+        else:
+            write_file_header(f_out, chunk_codec)
+
+        with guard:
+            index = compress_stream(iter_with_last(batches), f_out, max_threads, max_in_flight, compress_batch, chunk_codec, index, metrics)
+            write_index(f_out, index, flags, metadata, chunk_codec)  # Write metadata, chunk index and trailer
+
+def _to_gcsv_partitioned(df: pd.DataFrame, directory: str, partition_by, max_threads, write) -> list:
+    """
+    Write every group of rows sharing the partition_by values to its own file under directory with write(part, path,
+    max_threads=...). Up to max_threads partitions are written at once, each on an equal share of the threads,
+    so many small partitions use every core while a few big ones still compress in parallel.
+    """
+    columns = [partition_by] if isinstance(partition_by, str) else list(partition_by)
+    missing = [column for column in columns if column not in df.columns]
+    if not columns or missing:
+        raise ValueError(f"partition_by columns {missing or columns} aren't columns of the DataFrame")
+    groups = list(df.groupby(columns, sort=True, dropna=False))
+    if not groups:
+        return []
+
+    def write_group(group):
+        values, part = group
+        # Values are percent-encoded, so any value (i.e '2024/01/02' or NaN) makes a valid file name
+        names = [f"{column}={quote(str(value), safe='')}" for column, value in zip(columns, values)]
+        path = os.path.join(directory, *names[:-1], names[-1] + '.gcsv')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write(part, path, max_threads=max(max_threads // len(groups), 1))
+        return path
+
+    with ThreadPoolExecutor(max_workers=min(max_threads, len(groups))) as executor:
+        return list(executor.map(write_group, groups))
+
+def _to_gcsv_columnar(df: pd.DataFrame, gcsv_file: str, chunk_size=10, max_threads=16, max_in_flight=None, stats=False, codec=None,
+                      append=False, metrics=None):
+    """
+    Write a DataFrame as row groups where every column is rendered and compressed as its own chunk.
+    Row groups are sized so that each column chunk holds about chunk_size MB of CSV text.
     """
-    Compress CSV data directly from memory and write to the GCSV file using multithreading.
+    columns = [str(column) for column in df.columns]
+
+    # Estimate how many values fill a column chunk from a small rendered sample
+    sample_rows = min(len(df), 1000)
+    sample = df.iloc[:sample_rows].to_csv(index=False, header=False).encode('utf-8')
+    bytes_per_value = max(len(sample) // max(sample_rows * len(columns), 1), 1)
+    group_rows = int(max((chunk_size * 1024 * 1024) // bytes_per_value, 1))
+
+    # Work items are (start row, stop row, column position), row group by row group
+    groups = [(start, min(start + group_rows, len(df))) for start in range(0, len(df), group_rows)]
+    items = [(start, stop, position) for start, stop in groups for position in range(len(columns))]
+
+    def compress_column(item):
+        (start, stop, position), is_last = item
+        values = df.iloc[start:stop, position]
+        data = values.to_csv(index=False, header=False).encode('utf-8')
+        column_stats = csv_chunk_stats([columns[position]], data) if stats else None  # From the values as written
+        return codec.compress(data), len(data), stop - start, column_stats, zlib.crc32(data)
+
+    metadata = {
+        'layout': 'columnar',
+        'columns': columns,
+        'dtypes': [str(dtype) for dtype in df.dtypes],
+        'row_groups': [stop - start for start, stop in groups],
+    }
+    with open(gcsv_file, 'r+b' if append else 'wb') as f_out:
+        index, guard = [], nullcontext()
+        if append:
+            # New row groups go after the existing ones, with the file's codec
+            codec, index, flags, existing = load_for_append(f_out)
+            if not flags & FLAG_COLUMNAR:
+                raise ValueError("can't append layout='columnar' data to a row GCSV file")
+            if (existing['columns'], existing['dtypes']) != (metadata['columns'], metadata['dtypes']):
+                raise ValueError(f"columns {list(zip(metadata['columns'], metadata['dtypes']))} don't match the GCSV file's "
+                                 f"{list(zip(existing['columns'], existing['dtypes']))}")
+            metadata['row_groups'] = existing['row_groups'] + metadata['row_groups']
+            guard = appending(f_out, codec, index)  # A failed append puts the file back as it was
+        else:
+            write_file_header(f_out, codec)
+
+        with guard:
+            index = compress_stream(iter_with_last(items), f_out, max_threads, max_in_flight, compress_column, codec, index, metrics)
+            write_index(f_out, index, FLAG_COLUMNAR, metadata, codec)  # Write metadata, chunk index and trailer
+
+def gcsv_compress_from_memory(csv_data: str, gcsv_file: str, chunk_size=10, max_threads=16, row_aligned=True, codec='zlib', level=None):
+    """
+    Compress CSV data directly from memory and write to the GCSV file (followed by its chunk index) using multithreading.
     :param csv_data: CSV data as a string.
     :param gcsv_file: Path to the output GCSV file.
     :param chunk_size: Chunk size for compression.
     :param max_threads: Number of threads for compression.
+    :param row_aligned: Store the header as its own chunk and cut chunks on row boundaries.
+    :param codec: Compression codec.
+    :param level: Compression level of the codec.
     """
+    chunk_codec = get_codec(codec, level)
     with open(gcsv_file, 'wb') as f_out:
+        write_file_header(f_out, chunk_codec)
+
         # Split the data into chunks for compression
         chunk_size_bytes = chunk_size * 1024 * 1024  # Convert MB to bytes
-        num_chunks = (len(csv_data) + chunk_size_bytes - 1) // chunk_size_bytes  # Number of chunks
-
-        with ThreadPoolExecutor(max_workers=max_threads) as executor:
-            futures = []
-            for i in range(num_chunks):
-                start = i * chunk_size_bytes
-                end = min((i + 1) * chunk_size_bytes, len(csv_data))
-                chunk = csv_data[start:end]
-                futures.append(executor.submit(compress_chunk, chunk))
-
-            # Process the compressed data chunks and write them to the output file
-            for future in futures:
-                compressed_chunk = future.result()
-                f_out.write(len(compressed_chunk).to_bytes(4, 'big'))  # Write chunk header
-                f_out.write(compressed_chunk)  # Write chunk data
-
-def compress_chunk(chunk: str) -> bytes:
-    """Compress a single chunk of data."""
-    return zlib.compress(chunk.encode('utf-8'))
\ No newline at end of file
+        chunks = (csv_data[start:start + chunk_size_bytes].encode('utf-8') for start in range(0, len(csv_data), chunk_size_bytes))
+        if row_aligned:
+            chunks = iter_row_aligned(chunks)
+
+        compress = partial(compress_task, codec=chunk_codec, row_aligned=row_aligned)
+        index = compress_stream(iter_with_last(chunks), f_out, max_threads, compress=compress, codec=chunk_codec)
+        write_index(f_out, index, FLAG_ROW_ALIGNED if row_aligned else 0, codec=chunk_codec)  # Write chunk index and trailer
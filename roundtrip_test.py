@@ -0,0 +1,550 @@
+import os
+import sys
+import zlib
+import threading
+import json
+import asyncio
+import socket
+import subprocess
+import tempfile
+import traceback
+import numpy as np
+import pandas as pd
+import compress
+import pandas_gcsv
+from compress import gcsv_append, gcsv_compress, gcsv_compress_many
+from gcsv_async import AsyncGcsvWriter, aiter_gcsv, aiter_gcsv_chunks, aread_gcsv, configure_executor
+from decompress import gcsv_decompress, read_range, read_rows
+from gcsv_cache import cache_info, clear_cache, configure_cache
+from gcsv_codecs import available_codecs
+from gcsv_format import map_file, map_ordered, read_file_header, read_index
+from gcsv_metrics import STAGES, Metrics
+from gcsv_tuning import CHUNK_SIZES, Tuning, auto_settings, usable_cores
+from pandas_gcsv import read_gcsv, read_gcsv_dataset, read_gcsv_numpy, to_gcsv
+from verify import gcsv_verify
+
+# Round trips through every reader and writer, on small chunks so every file has many of them.
+# Run as a script (python roundtrip_test.py) or with pytest, which passes each test a temporary directory.
+
+CHUNK_MB = 0.05
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def sample_frame(rows=20000):
+    """A frame with ints, floats, strings needing quotes (commas, quotes, line breaks) and dates."""
+    ids = np.arange(rows)
+    return pd.DataFrame({
+        'id': ids,
+        'price': np.round(ids * 0.25, 2),
+        'note': np.where(ids % 7 == 0, 'a "12" screen,\nwith a line break', 'plain'),
+        'day': pd.Timestamp('2024-01-01') + pd.to_timedelta(ids // 5000, unit='D'),
+    })
+
+def write_csv(df, path):
+    df.to_csv(path, index=False)
+    return path
+
+def same_bytes(path_a, path_b):
+    with open(path_a, 'rb') as a, open(path_b, 'rb') as b:
+        return a.read() == b.read()
+
+def run_script(script, *args, env=None, **kwargs):
+    """Run one of the command line scripts with the current interpreter, capturing its output."""
+    return subprocess.run([sys.executable, os.path.join(HERE, script), *args], capture_output=True,
+                          env={**os.environ, **(env or {})}, **kwargs)
+
+def read_gcsv_index(gcsv_file):
+    with open(gcsv_file, 'rb') as f:
+        return read_index(f)
+
+def corrupt_chunk(gcsv_file, chunk_number, output_file):
+    """Copy gcsv_file to output_file with one byte flipped in the middle of a chunk."""
+    with open(gcsv_file, 'rb') as f:
+        entry = read_index(f)[chunk_number]
+        f.seek(0)
+        data = bytearray(f.read())
+    data[entry.offset + entry.length // 2] ^= 0xff
+    with open(output_file, 'wb') as f:
+        f.write(data)
+
+def test_bounded_window(tmp_path):
+    # Items are read at most max_in_flight ahead of the results handed out (plus the one being submitted),
+    # on no more than max_threads workers, and the results keep the input order
+    read, results, ahead, workers = [0], [], [], set()
+
+    def items():
+        for item in range(200):
+            read[0] += 1
+            ahead.append(read[0] - len(results))
+            yield item
+
+    def work(item):
+        workers.add(threading.get_ident())
+        return item * 2
+
+    for result in map_ordered(work, items(), max_threads=3, max_in_flight=5):
+        results.append(result)
+    assert results == [item * 2 for item in range(200)]
+    assert max(ahead) <= 5 + 1 and len(workers) <= 3
+
+    csv_file = write_csv(sample_frame(), os.path.join(tmp_path, 'data.csv'))
+    gcsv_file = os.path.join(tmp_path, 'data.gcsv')
+    gcsv_compress(csv_file, gcsv_file, CHUNK_MB, 4, max_in_flight=1)
+    gcsv_decompress(gcsv_file, os.path.join(tmp_path, 'out.csv'))
+    assert same_bytes(csv_file, os.path.join(tmp_path, 'out.csv'))
+
+def test_decompress_to_stdout(tmp_path):
+    csv_file = write_csv(sample_frame(), os.path.join(tmp_path, 'data.csv'))
+    gcsv_file = os.path.join(tmp_path, 'data.gcsv')
+    gcsv_compress(csv_file, gcsv_file, CHUNK_MB, 4)
+    with open(csv_file, 'rb') as f:
+        expected = f.read()
+
+    # Without an output file (or with '-') the CSV goes to stdout, chunk by chunk through a small window
+    for args in ((), ('-',), ('-', '--max-in-flight', '1')):
+        result = run_script('decompress.py', gcsv_file, *args)
+        assert (result.returncode, result.stdout, result.stderr) == (0, expected, b''), args
+
+    # A reader that stops early (i.e | head) ends it quietly with status 1, without a traceback
+    process = subprocess.Popen([sys.executable, os.path.join(HERE, 'decompress.py'), gcsv_file],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert process.stdout.read(100) == expected[:100]
+    process.stdout.close()
+    assert process.wait(timeout=60) == 1
+    assert process.stderr.read() == b''
+    process.stderr.close()
+
+def test_every_codec(tmp_path):
+    csv_file = write_csv(sample_frame(), os.path.join(tmp_path, 'data.csv'))
+    expected = pd.read_csv(csv_file)
+    for codec in available_codecs():
+        for row_aligned in (True, False):
+            gcsv_file = os.path.join(tmp_path, f'{codec}.gcsv')
+            gcsv_compress(csv_file, gcsv_file, CHUNK_MB, 4, row_aligned=row_aligned, codec=codec)
+            gcsv_decompress(gcsv_file, os.path.join(tmp_path, 'out.csv'))
+            assert same_bytes(csv_file, os.path.join(tmp_path, 'out.csv')), (codec, row_aligned)
+            assert read_gcsv(gcsv_file).equals(expected), (codec, row_aligned)
+
+def test_file_without_index(tmp_path):
+    # Files written before the chunk index existed are only size-prefixed zlib chunks
+    csv_file = write_csv(sample_frame(), os.path.join(tmp_path, 'data.csv'))
+    with open(csv_file, 'rb') as f:
+        data = f.read()
+    gcsv_file = os.path.join(tmp_path, 'legacy.gcsv')
+    with open(gcsv_file, 'wb') as f:
+        for start in range(0, len(data), 100000):
+            chunk = zlib.compress(data[start:start + 100000])
+            f.write(len(chunk).to_bytes(4, 'big'))
+            f.write(chunk)
+    gcsv_decompress(gcsv_file, os.path.join(tmp_path, 'out.csv'))
+    assert same_bytes(csv_file, os.path.join(tmp_path, 'out.csv'))
+    assert read_gcsv(gcsv_file).equals(pd.read_csv(csv_file))
+    assert pd.concat(read_gcsv(gcsv_file, chunksize=3000)).equals(pd.read_csv(csv_file))
+
+def test_dictionary(tmp_path):
+    df = sample_frame()
+    csv_file = write_csv(df, os.path.join(tmp_path, 'data.csv'))
+    gcsv_file = os.path.join(tmp_path, 'dict.gcsv')
+    gcsv_compress(csv_file, gcsv_file, CHUNK_MB, 4, dictionary=True)
+    gcsv_decompress(gcsv_file, os.path.join(tmp_path, 'out.csv'))
+    assert same_bytes(csv_file, os.path.join(tmp_path, 'out.csv'))
+
+    to_gcsv(df, gcsv_file, CHUNK_MB, 4, dictionary=True)
+    assert read_gcsv(gcsv_file).equals(pd.read_csv(csv_file))
+
+def test_row_aligned_quoting(tmp_path):
+    # Quoted fields with commas, escaped quotes and line breaks, and unquoted inch marks, cut across many chunks
+    lines = ['id,text']
+    for i in range(20000):
+        lines.append(f'{i},"line one\nline ""two"", {i}"' if i % 3 == 0 else f'{i},a {i % 40}" screen')
+    csv_file = os.path.join(tmp_path, 'quoted.csv')
+    with open(csv_file, 'w', newline='') as f:
+        f.write('\n'.join(lines) + '\n')
+    expected = pd.read_csv(csv_file)
+
+    gcsv_file = os.path.join(tmp_path, 'quoted.gcsv')
+    gcsv_compress(csv_file, gcsv_file, CHUNK_MB, 4)
+    assert len(read_gcsv_index(gcsv_file)) > 5
+    assert read_gcsv(gcsv_file).equals(expected)
+    assert pd.concat(read_gcsv(gcsv_file, chunksize='chunk')).equals(expected)
+    assert read_gcsv(gcsv_file, rows=slice(9998, 10011)).reset_index(drop=True).equals(expected.iloc[9998:10011].reset_index(drop=True))
+
+def test_empty_file(tmp_path):
+    csv_file = os.path.join(tmp_path, 'empty.csv')
+    open(csv_file, 'wb').close()
+    gcsv_file = os.path.join(tmp_path, 'empty.gcsv')
+    gcsv_compress(csv_file, gcsv_file, CHUNK_MB, 4)
+    gcsv_decompress(gcsv_file, os.path.join(tmp_path, 'out.csv'))
+    assert same_bytes(csv_file, os.path.join(tmp_path, 'out.csv'))
+    for read in (read_gcsv, read_gcsv_dataset):
+        assert raises(pd.errors.EmptyDataError, read, gcsv_file)
+
+def test_rows_and_read_range(tmp_path):
+    df = sample_frame()
+    csv_file = write_csv(df, os.path.join(tmp_path, 'data.csv'))
+    with open(csv_file, 'rb') as f:
+        data = f.read()
+    expected = pd.read_csv(csv_file)
+    for row_aligned in (True, False):
+        gcsv_file = os.path.join(tmp_path, 'data.gcsv')
+        gcsv_compress(csv_file, gcsv_file, CHUNK_MB, 4, row_aligned=row_aligned)
+        assert read_range(gcsv_file, 12345, 98765) == data[12345:98765]
+        assert read_range(gcsv_file, 0, len(data) + 10) == data
+
+        # Rows of the sample frame hold line breaks, which only row-aligned files count as rows
+        if row_aligned:
+            for rows in (slice(0, 10), slice(4990, 5020), slice(-25, None)):
+                assert read_gcsv(gcsv_file, rows=rows).reset_index(drop=True).equals(expected.iloc[rows].reset_index(drop=True))
+
+            # rows= also applies to the chunked iterator
+            frames = list(read_gcsv(gcsv_file, rows=slice(4990, 5020), chunksize=7))
+            assert [len(frame) for frame in frames] == [7, 7, 7, 7, 2]
+            assert pd.concat(frames, ignore_index=True).equals(expected.iloc[4990:5020].reset_index(drop=True))
+        assert read_rows(gcsv_file, 0, 1) == data[:data.index(b'\n') + 1]
+
+def test_chunksize_dtype_carry(tmp_path):
+    # The first chunks only hold whole numbers, later ones hold fractions and missing values
+    n = 20000
+    df = pd.DataFrame({'id': np.arange(n), 'value': np.where(np.arange(n) < 15000, 1.0, 2.5)})
+    df.loc[n - 3, 'value'] = np.nan
+    csv_file = write_csv(df, os.path.join(tmp_path, 'data.csv'))
+    gcsv_file = os.path.join(tmp_path, 'data.gcsv')
+    gcsv_compress(csv_file, gcsv_file, CHUNK_MB, 4)
+
+    expected = pd.read_csv(csv_file)
+    for chunksize in ('chunk', 3000):
+        frames = list(read_gcsv(gcsv_file, chunksize=chunksize))
+        assert pd.concat(frames).equals(expected), chunksize
+        assert all(frame['id'].dtype == np.int64 for frame in frames)
+
+def test_filters_pruning(tmp_path):
+    df = sample_frame()
+    gcsv_file = os.path.join(tmp_path, 'stats.gcsv')
+    to_gcsv(df, gcsv_file, CHUNK_MB, 4, stats=True)
+    expected = df[(df['id'] >= 100) & (df['id'] < 200)].reset_index(drop=True)
+    result = read_gcsv(gcsv_file, filters=[('id', '>=', 100), ('id', '<', 200)], parse_dates=['day'])
+    assert result.equals(expected)
+
+    # Chunks ruled out by their statistics are never decompressed, so a corrupt one doesn't matter
+    index = read_gcsv_index(gcsv_file)
+    corrupt_chunk(gcsv_file, len(index) - 1, os.path.join(tmp_path, 'bad.gcsv'))
+    bad_file = os.path.join(tmp_path, 'bad.gcsv')
+    assert read_gcsv(bad_file, filters=[('id', '<', 200)], parse_dates=['day']).equals(df[df['id'] < 200])
+    assert raises(ValueError, read_gcsv, bad_file)
+
+    # Filter columns left out of usecols are read to filter, then dropped
+    result = read_gcsv(gcsv_file, filters=[('id', '==', 12345)], usecols=['price'])
+    assert list(result.columns) == ['price'] and result['price'].tolist() == [12345 * 0.25]
+
+def test_filter_dates_as_text(tmp_path):
+    # Dates are stored as the text to_csv writes (2024-01-02), so a string filter must find every row of that day
+    df = sample_frame()
+    expected = df[df['day'] == '2024-01-02'].reset_index(drop=True)
+    csv_file = write_csv(df, os.path.join(tmp_path, 'data.csv'))
+    gcsv_compress(csv_file, os.path.join(tmp_path, 'compressed.gcsv'), CHUNK_MB, 4, stats=True)
+    to_gcsv(df, os.path.join(tmp_path, 'row.gcsv'), CHUNK_MB, 4, stats=True)
+    to_gcsv(df, os.path.join(tmp_path, 'columnar.gcsv'), CHUNK_MB, 4, stats=True, layout='columnar')
+    for name in ('compressed', 'row', 'columnar'):
+        kwargs = {} if name == 'columnar' else {'parse_dates': ['day']}  # Columnar files keep their dtypes
+        result = read_gcsv(os.path.join(tmp_path, f'{name}.gcsv'), filters=[('day', '==', '2024-01-02')], **kwargs)
+        assert result.equals(expected), name
+
+    to_gcsv(df.assign(part=df['id'] % 3), os.path.join(tmp_path, 'dataset'), CHUNK_MB, 4, partition_by='part', stats=True)
+    result = read_gcsv_dataset(os.path.join(tmp_path, 'dataset'), filters=[('day', '==', '2024-01-02')], parse_dates=['day'])
+    assert len(result) == len(expected)
+
+def test_columnar(tmp_path):
+    df = sample_frame()
+    gcsv_file = os.path.join(tmp_path, 'columnar.gcsv')
+    to_gcsv(df, gcsv_file, CHUNK_MB, 4, layout='columnar', stats=True)
+    assert read_gcsv(gcsv_file).equals(df)
+    assert read_gcsv(gcsv_file, usecols=['price', 'day']).equals(df[['price', 'day']])
+    assert pd.concat(read_gcsv(gcsv_file, chunksize=3000)).equals(df)
+    assert read_gcsv(gcsv_file, filters=[('id', 'in', [3, 19999])]).equals(df[df['id'].isin([3, 19999])].reset_index(drop=True))
+
+def test_numpy(tmp_path):
+    values = np.arange(60000, dtype=np.float64).reshape(-1, 3) / 4
+    gcsv_file = os.path.join(tmp_path, 'numbers.gcsv')
+    to_gcsv(pd.DataFrame(values, columns=['a', 'b', 'c']), gcsv_file, CHUNK_MB, 4)
+    assert np.array_equal(read_gcsv_numpy(gcsv_file), values)
+    assert raises(ValueError, read_gcsv_numpy, gcsv_file, np.uint8)
+
+def test_append(tmp_path):
+    df = sample_frame()
+    first, second = df.iloc[:12000], df.iloc[12000:]
+    first_csv = os.path.join(tmp_path, 'first.csv')
+    with open(first_csv, 'w', newline='') as f:
+        f.write(first.to_csv(index=False).rstrip('\n'))  # The appended rows start after a newline chunk
+    second_csv = os.path.join(tmp_path, 'second.csv')
+    second.to_csv(second_csv, index=False)
+    both = pd.read_csv(write_csv(df, os.path.join(tmp_path, 'both.csv')))
+
+    for codec in ('zlib', 'gzip'):
+        gcsv_file = os.path.join(tmp_path, f'append_{codec}.gcsv')
+        gcsv_compress(first_csv, gcsv_file, CHUNK_MB, 4, codec=codec)
+        # A reader that mapped the file keeps reading its chunks, as the file never shrinks below them
+        with open(gcsv_file, 'rb') as f:
+            chunk_codec, _ = read_file_header(f)
+            old_index, view = read_index(f), map_file(f)
+        gcsv_append(second_csv, gcsv_file, CHUNK_MB, 4)
+        assert all(len(chunk_codec.decompress(view[entry.offset:entry.offset + entry.length])) == entry.raw_length for entry in old_index)
+        assert read_gcsv(gcsv_file).equals(both), codec
+        assert gcsv_verify(gcsv_file) == [], codec
+        assert read_rows(gcsv_file, 12000, 12002) == b'11999,2999.75,plain,2024-01-03\n12000,3000.0,plain,2024-01-03\n', codec
+
+    numbers_csv = os.path.join(tmp_path, 'numbers.csv')
+    with open(numbers_csv, 'w', newline='') as f:
+        f.write(first[['id', 'price']].to_csv(index=False).rstrip('\n'))
+    gcsv_file = os.path.join(tmp_path, 'numbers.gcsv')
+    gcsv_compress(numbers_csv, gcsv_file, CHUNK_MB, 4)
+    gcsv_append(write_csv(second[['id', 'price']], os.path.join(tmp_path, 'more.csv')), gcsv_file, CHUNK_MB, 4)
+    assert np.array_equal(read_gcsv_numpy(gcsv_file), df[['id', 'price']].to_numpy(np.float64))
+
+    for layout in ('row', 'columnar'):
+        gcsv_file = os.path.join(tmp_path, f'append_{layout}.gcsv')
+        to_gcsv(first, gcsv_file, CHUNK_MB, 4, layout=layout)
+        to_gcsv(second, gcsv_file, CHUNK_MB, 4, layout=layout, mode='a')
+        result = read_gcsv(gcsv_file) if layout == 'columnar' else read_gcsv(gcsv_file, parse_dates=['day'])
+        assert result.equals(df), layout
+
+def test_failed_append(tmp_path):
+    df = sample_frame()
+    csv_file = write_csv(df, os.path.join(tmp_path, 'data.csv'))
+
+    def failing_stream(items, f_out, *args, **kwargs):
+        f_out.write(b'half-written chunks')
+        raise RuntimeError('disk full')
+
+    for layout in ('row', 'columnar'):
+        gcsv_file = os.path.join(tmp_path, f'{layout}.gcsv')
+        to_gcsv(df, gcsv_file, CHUNK_MB, 4, layout=layout)
+        with open(gcsv_file, 'rb') as f:
+            before = f.read()
+        for module, append in ((pandas_gcsv, lambda: to_gcsv(df, gcsv_file, CHUNK_MB, 4, layout=layout, mode='a')),
+                               (compress, lambda: gcsv_append(csv_file, gcsv_file, CHUNK_MB, 4))):
+            if module is compress and layout == 'columnar':
+                continue
+            original, module.compress_stream = module.compress_stream, failing_stream
+            try:
+                assert raises(RuntimeError, append)
+            finally:
+                module.compress_stream = original
+            # The file is left exactly as it was before the append
+            with open(gcsv_file, 'rb') as f:
+                assert f.read() == before, (layout, module.__name__)
+        assert len(read_gcsv(gcsv_file)) == len(df)
+
+def test_verify(tmp_path):
+    csv_file = write_csv(sample_frame(), os.path.join(tmp_path, 'data.csv'))
+    for codec in ('zlib', 'gzip'):
+        gcsv_file = os.path.join(tmp_path, f'{codec}.gcsv')
+        gcsv_compress(csv_file, gcsv_file, CHUNK_MB, 4, codec=codec)
+        assert gcsv_verify(gcsv_file) == []
+
+        bad_file = os.path.join(tmp_path, 'bad.gcsv')
+        corrupt_chunk(gcsv_file, 3, bad_file)
+        assert [chunk for chunk, _ in gcsv_verify(bad_file)] == [3], codec
+        assert raises(ValueError, gcsv_decompress, bad_file, os.path.join(tmp_path, 'out.csv'))
+
+        # A file cut short loses its trailer
+        with open(gcsv_file, 'rb') as f:
+            data = f.read()
+        with open(bad_file, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        assert gcsv_verify(bad_file)[0][0] is None
+
+def test_cache(tmp_path):
+    df = sample_frame()
+    gcsv_file = os.path.join(tmp_path, 'cached.gcsv')
+    to_gcsv(df, gcsv_file, CHUNK_MB, 4)
+    expected = read_gcsv(gcsv_file)
+    spill_dir = os.path.join(tmp_path, 'spill')
+    configure_cache(max_mb=0.1, spill_dir=spill_dir, max_spill_mb=1)
+    try:
+        assert read_gcsv(gcsv_file).equals(expected)
+        assert read_gcsv(gcsv_file).equals(expected)
+        info = cache_info()
+        assert info.hits + info.spill_hits > 0 and info.misses > 0
+        assert info.spill_bytes <= info.max_spill_bytes
+
+        # A later cache counts the chunks spilled before it
+        configure_cache(max_mb=0.1, spill_dir=spill_dir, max_spill_mb=1)
+        assert cache_info().spill_bytes == info.spill_bytes
+        clear_cache()
+        assert os.listdir(spill_dir) == []
+    finally:
+        configure_cache(max_mb=0)
+
+def test_auto_settings(tmp_path):
+    with open(write_csv(sample_frame(), os.path.join(tmp_path, 'data.csv')), 'rb') as f:
+        sample = f.read()
+    cache = os.path.join(tmp_path, 'tuning', 'tuning.json')
+
+    # Probed settings are plausible for this machine and cached under its host name
+    settings = auto_settings(sample, 'zlib', 'max_ratio', cache=cache)
+    assert settings.chunk_size in CHUNK_SIZES and 1 <= settings.max_threads <= usable_cores() and settings.level in (1, 6, 9)
+    with open(cache) as f:
+        assert json.load(f) == {socket.gethostname(): {'zlib:max_ratio': settings._asdict()}}
+
+    # Later runs read the cache instead of probing, and max_throughput spreads small inputs over the threads
+    with open(cache, 'w') as f:
+        json.dump({socket.gethostname(): {'zlib:max_throughput': {'chunk_size': 4, 'max_threads': 8, 'level': 1}}}, f)
+    assert auto_settings(sample, 'zlib', 'max_throughput', cache=cache) == Tuning(4, 8, 1)
+    assert auto_settings(sample, 'zlib', 'max_throughput', 8 * 1024 * 1024, cache=cache) == Tuning(1, 8, 1)
+    assert auto_settings(sample, 'zlib', 'max_throughput', 1024, cache=cache) == Tuning(CHUNK_SIZES[0], 8, 1)
+    assert raises(ValueError, auto_settings, sample, 'zlib', 'fastest', cache=cache)
+
+    # The command line picks them up from the cache file named by GCSV_TUNING_CACHE
+    csv_file = os.path.join(tmp_path, 'data.csv')
+    gcsv_file = os.path.join(tmp_path, 'data.gcsv')
+    result = run_script('compress.py', csv_file, gcsv_file, '--auto', 'max_throughput', env={'GCSV_TUNING_CACHE': cache})
+    assert result.returncode == 0, result.stderr
+    gcsv_decompress(gcsv_file, os.path.join(tmp_path, 'out.csv'))
+    assert same_bytes(csv_file, os.path.join(tmp_path, 'out.csv'))
+    assert len(read_gcsv_index(gcsv_file)) > 1  # Chunks cut small enough to give all 8 threads work
+
+def test_metrics(tmp_path):
+    csv_file = write_csv(sample_frame(), os.path.join(tmp_path, 'data.csv'))
+    gcsv_file = os.path.join(tmp_path, 'data.gcsv')
+    progress = []
+    metrics = Metrics('compress', callback=lambda m: progress.append(m.bytes_in))
+    gcsv_compress(csv_file, gcsv_file, CHUNK_MB, 4, metrics=metrics)
+    index = read_gcsv_index(gcsv_file)
+
+    # Every chunk is counted (and reported to the callback) once, with its bytes in and out
+    summary = metrics.summary()
+    assert summary['chunks'] == len(index) == len(progress)
+    assert summary['bytes_in'] == os.path.getsize(csv_file) == progress[-1] == metrics.total
+    assert summary['bytes_out'] == sum(entry.length for entry in index)
+    assert summary['ratio'] == round(summary['bytes_in'] / summary['bytes_out'], 3) and summary['codec'] == 'zlib'
+    assert set(summary['stage_seconds']) == {'read', 'queue_wait', 'compress', 'write'} and summary['bound'] in ('cpu', 'io')
+
+    metrics = Metrics('decompress')
+    gcsv_decompress(gcsv_file, os.path.join(tmp_path, 'out.csv'), 4, metrics=metrics)
+    assert (metrics.chunks, metrics.bytes_out) == (len(index), os.path.getsize(csv_file))
+
+    # The scripts print nothing by default, and write the summary with --metrics (to stderr with '-')
+    result = run_script('compress.py', csv_file, gcsv_file, '--chunk-size', str(CHUNK_MB))
+    assert (result.returncode, result.stdout, result.stderr) == (0, b'', b'')
+    result = run_script('compress.py', csv_file, gcsv_file, '--chunk-size', str(CHUNK_MB), '--metrics', '-')
+    assert result.returncode == 0 and json.loads(result.stderr)['chunks'] == len(index)
+    summary_file = os.path.join(tmp_path, 'metrics.json')
+    result = run_script('decompress.py', gcsv_file, os.path.join(tmp_path, 'out.csv'), '--metrics', summary_file)
+    assert (result.returncode, result.stdout) == (0, b'')
+    with open(summary_file) as f:
+        summary = json.load(f)
+    assert summary['bytes_out'] == os.path.getsize(csv_file) and len(summary['stage_seconds']) == len(STAGES)
+
+def test_dataset(tmp_path):
+    df = sample_frame()
+    directory = os.path.join(tmp_path, 'dataset')
+    metrics = Metrics('compress')
+    paths = to_gcsv(df, directory, CHUNK_MB, 4, partition_by='day', stats=True, metrics=metrics)
+    # The partitions are written concurrently into one Metrics, which must count every chunk of every file
+    entries = [entry for path in paths for entry in read_gcsv_index(path)]
+    assert (metrics.chunks, metrics.bytes_in) == (len(entries), sum(entry.raw_length for entry in entries))
+    result = read_gcsv_dataset(directory, parse_dates=['day'])
+    assert result.equals(df)
+    result = read_gcsv_dataset(os.path.join(directory, '*.gcsv'), filters=[('id', '>=', 19990)], parse_dates=['day'])
+    assert result.equals(df[df['id'] >= 19990].reset_index(drop=True))
+
+def test_compress_many(tmp_path):
+    df = sample_frame()
+    exports = os.path.join(tmp_path, 'exports')
+    os.makedirs(os.path.join(exports, '2024'))
+    inputs = [write_csv(df.iloc[:7000], os.path.join(exports, 'a.csv')),
+              write_csv(df.iloc[:0], os.path.join(exports, 'empty.csv')),
+              write_csv(df.iloc[7000:], os.path.join(exports, '2024', 'b.csv'))]
+    single = write_csv(df.iloc[:10], os.path.join(tmp_path, 'single.csv'))
+
+    # Directories keep their layout under output_dir, and every file (an empty one too) round trips
+    output_dir = os.path.join(tmp_path, 'out')
+    paths = gcsv_compress_many([exports, single], output_dir, CHUNK_MB, 4, stats=True)
+    assert paths == [os.path.join(output_dir, *name.split('/')) for name in ('2024/b.gcsv', 'a.gcsv', 'empty.gcsv', 'single.gcsv')]
+    for input_file, path in zip(sorted(inputs) + [single], paths):
+        gcsv_decompress(path, os.path.join(tmp_path, 'out.csv'))
+        assert same_bytes(input_file, os.path.join(tmp_path, 'out.csv')), path
+        assert gcsv_verify(path) == []
+    assert raises(ValueError, gcsv_compress_many, [inputs[0], os.path.join(exports, 'a.csv')], output_dir)
+
+    # The command line takes several inputs (or a directory) and an output directory
+    cli_dir = os.path.join(tmp_path, 'cli')
+    result = run_script('compress.py', inputs[0], single, cli_dir, '--chunk-size', str(CHUNK_MB))
+    assert result.returncode == 0, result.stderr
+    assert sorted(os.listdir(cli_dir)) == ['a.gcsv', 'single.gcsv']
+    assert read_gcsv(os.path.join(cli_dir, 'a.gcsv'), parse_dates=['day']).equals(df.iloc[:7000])
+    assert run_script('compress.py', exports, cli_dir, '--append').returncode == 2
+
+def test_async(tmp_path):
+    df = sample_frame()
+    csv_file = write_csv(df, os.path.join(tmp_path, 'data.csv'))
+    with open(csv_file, 'rb') as f:
+        data = f.read()
+    gcsv_file = os.path.join(tmp_path, 'data.gcsv')
+    gcsv_compress(csv_file, gcsv_file, CHUNK_MB, 4, stats=True)
+    expected = read_gcsv(gcsv_file, parse_dates=['day'])
+
+    async def read():
+        assert (await aread_gcsv(gcsv_file, parse_dates=['day'])).equals(expected)
+        assert (await aread_gcsv(gcsv_file, rows=slice(100, 300))).equals(read_gcsv(gcsv_file, rows=slice(100, 300)))
+        frames = [frame async for frame in aiter_gcsv(gcsv_file, filters=[('id', '<', 5000)], max_in_flight=2)]
+        assert 1 < len(frames) < len(read_gcsv_index(gcsv_file)) - 1  # Chunks past the filter are skipped
+        assert pd.concat(frames, ignore_index=True).equals(pd.read_csv(csv_file, nrows=5000))
+
+        # Resizing the shared executor mid-stream sends the remaining chunks to the new one
+        chunks = []
+        async for chunk in aiter_gcsv_chunks(gcsv_file, max_in_flight=3):
+            chunks.append(chunk)
+            if len(chunks) in (2, 5):
+                configure_executor(len(chunks) // 2)
+        assert b''.join(chunks) == data
+
+    async def write(path, batches, **kwargs):
+        async with AsyncGcsvWriter(path, CHUNK_MB, max_in_flight=2, **kwargs) as writer:
+            for batch in batches:
+                await writer.write(batch)
+
+    async def mixed(path):
+        async with AsyncGcsvWriter(path) as writer:
+            await writer.write(data[:100])
+            await writer.write(df)
+
+    try:
+        asyncio.run(read())
+
+        # Byte batches are cut at rows whatever their size (the header line may be split too)
+        bytes_file = os.path.join(tmp_path, 'bytes.gcsv')
+        asyncio.run(write(bytes_file, [data[start:start + 7777] for start in range(0, len(data), 7777)], codec='gzip'))
+        assert read_gcsv(bytes_file, parse_dates=['day']).equals(df)
+        assert gcsv_verify(bytes_file) == []
+
+        frame_file = os.path.join(tmp_path, 'frames.gcsv')
+        asyncio.run(write(frame_file, [df.iloc[start:start + 3000] for start in range(0, len(df), 3000)]))
+        assert read_gcsv(frame_file, parse_dates=['day']).equals(df)
+        assert raises(ValueError, asyncio.run, mixed(os.path.join(tmp_path, 'mixed.gcsv')))
+    finally:
+        configure_executor()
+
+def raises(exception, func, *args, **kwargs):
+    """Return whether func(*args, **kwargs) raises exception."""
+    try:
+        func(*args, **kwargs)
+    except exception:
+        return True
+    return False
+
+def main():
+    tests = [(name, test) for name, test in globals().items() if name.startswith('test_')]
+    failed = 0
+    for name, test in tests:
+        with tempfile.TemporaryDirectory() as tmp_path:
+            try:
+                test(tmp_path)
+                print(f'[TEST PASSED] {name}')
+            except Exception:
+                failed += 1
+                print(f'[TEST FAILED] {name}')
+                traceback.print_exc()
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# verify.py
+import sys
+import argparse
+from gcsv_format import (
+    decompress_checked, is_gzip, iter_mapped_chunks, map_file, map_ordered, read_file_header, read_index, read_trailer,
+)
+
+def gcsv_verify(input_file, max_threads=16, max_in_flight=None):
+    """
+    Check every chunk of a GCSV file on a pool of max_threads threads, without writing anything.
+    Each chunk is decompressed in memory and checked against its index entry: its uncompressed length and
+    CRC32 (the member CRC32 for gzip files; files written before checksums existed only get the length check).
+    Returns the bad chunks as (chunk number, error) pairs, with None as the chunk number for file-level errors.
+    """
+    problems = []
+    with open(input_file, 'rb') as f_in:
+        codec, start = read_file_header(f_in)
+        view = map_file(f_in)
+
+        # Files with a header always end with a trailer (gzip files with their end member)
+        if read_trailer(f_in) is None and (start > 0 or is_gzip(f_in)):
+            problems.append((None, "no trailer, the file is truncated or was never finished"))
+            # Without the index, check that the chunks which are still there decompress
+            items = ((chunk, None) for chunk in iter_mapped_chunks(view, start, len(view)))
+        else:
+            try:
+                index = read_index(f_in)
+            except Exception as e:  # A damaged index can fail in the codec, struct or json
+                return problems + [(None, f"can't read the chunk index ({e})")]
+            items = ((view[entry.offset:entry.offset + entry.length], entry) for entry in index)
+
+    def check(item):
+        # Workers decompress zero-copy slices of the mapped file and drop the data once it is checked
+        chunk, entry = item
+        try:
+            if entry is None:
+                codec.decompress(chunk)
+            else:
+                decompress_checked(codec, chunk, entry)
+        except Exception as e:  # Every codec has its own error type
+            return str(e)
+        return None
+
+    try:
+        for chunk_index, error in enumerate(map_ordered(check, items, max_threads, max_in_flight)):
+            if error is not None:
+                problems.append((chunk_index, error))
+    except ValueError as e:  # A chunk header past the end of a truncated file
+        problems.append((None, str(e)))
+    return problems
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check every chunk of a GCSV file against its length and CRC32 without decompressing it to disk.")
+    parser.add_argument("input_file", help="Path to the GCSV file to check. (i.e bitcoin.gcsv)")
+    parser.add_argument("--max-threads", type=int, default=16, help="Maximum number of threads to use for decompression (i.e 16)")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="Maximum number of chunks held in memory at once (defaults to 2 x max threads)")
+    args = parser.parse_args()
+
+    problems = gcsv_verify(args.input_file, args.max_threads, args.max_in_flight)
+    for chunk_index, error in problems:
+        print(error if chunk_index is None else f"chunk {chunk_index}: {error}")
+    print(f"{args.input_file}: {len(problems)} problem(s) found" if problems else f"{args.input_file}: OK")
+    sys.exit(1 if problems else 0)